@@ -1,23 +1,203 @@
 
 # visit http://127.0.0.1:8050/ in your web browser.
-import json
-from json import JSONEncoder
+import contextlib
+import functools
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+import zlib
 import numpy as np
-from pathlib import Path
-from dash import Dash, dcc, html
-from dash.dependencies import Input, Output, State
-import plotly.express as px
+from flask import Response, abort, g, request, send_from_directory
+from dash import Dash, dcc, html, ctx, no_update
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import miscellaneous_functions as misc
 import dash_graphing_functions  as dash_graph
+from caching import LRUCache, VolumeRegistry
+from volume_stats import VolumeStats
+from volume_pyramid import MIN_LEVEL_VOXELS, VolumePyramid
+from projections import PROJECTIONS, VolumeProjections
+from figure_encoding import binary_figure, compact_plane
+from prefetch import Prefetcher
+from coalescing import RequestCoalescer
+from jobs import JobManager
+import kaleido_pool
+import colormaps
+import metrics
+import profiling
 
 
+# Memory budget for loaded volumes kept on the server (bytes)
+VOLUME_CACHE_BYTES = 4 * 1024**3
 
-class NumpyArrayEncoder(JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        return JSONEncoder.default(self, obj)
+# Memory budget for rendered 2D slice figures (bytes)
+SLICE_CACHE_BYTES = 256 * 1024**2
+
+# Slices on either side of the displayed one rendered ahead in the
+# background, and the number of threads doing it
+PREFETCH_RADIUS = 3
+PREFETCH_WORKERS = 2
+
+# While a slider is dragged and an earlier slice request from the same
+# session and axis is still in flight, a new request waits this long
+# (seconds) for a newer one; superseded requests are dropped
+SLIDER_SETTLE_SECONDS = 0.03
+
+# 3D renders and PNG exports run as background jobs on this many threads;
+# the browser polls for their results every JOB_POLL_MS milliseconds
+JOB_WORKERS = 2
+JOB_POLL_MS = 500
+
+# Number of warm Kaleido processes used for PNG exports
+KALEIDO_POOL_SIZE = 3
+
+# PNG summaries are streamed to files in EXPORT_DIR. Files up to
+# SEND_FILE_MAX_BYTES go through the Download component; larger ones are
+# offered as a link to the /exports/ route, which streams them from disk.
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), 'volume-viewer-exports')
+SEND_FILE_MAX_BYTES = 32 * 1024**2
+
+# Default number of voxels sent to the browser for the 3D rendering
+DEFAULT_VOXEL_BUDGET = 1_000_000
+
+# Render the 2D slices in the browser: each plane is fetched once from the
+# binary /volumes/ endpoint and colormap/window changes are applied by the
+# clientside callbacks in assets/slice_viewer.js. The /volumes/ route is
+# only registered while this is set.
+CLIENTSIDE_SLICES = False
+
+# Send figure arrays to the browser as base64 typed arrays instead of JSON
+# lists. Typed arrays need plotly.js >= 2.28; Dash 2.14 bundles 2.24, so with
+# this flag the page loads PLOTLY_JS_URL instead (dcc.Graph uses an already
+# loaded window.Plotly). Point it at a locally served copy when offline.
+BINARY_FIGURES = False
+PLOTLY_JS_URL = "https://cdn.plot.ly/plotly-2.35.2.min.js"
+
+# Record latency and payload sizes of every callback request, and the stage
+# durations of 3D renders and exports, on the /metrics route (Prometheus
+# text format, served to local clients only). METRICS_TRACE_MEMORY also
+# records peak allocations with tracemalloc, which slows the server down.
+METRICS_ENABLED = True
+METRICS_TRACE_MEMORY = False
+METRICS_CLIENTS = ('127.0.0.1', '::1')
+
+# Profile with a sampling profiler, saving folded stacks (flamegraph input)
+# of the last PROFILE_KEEP captures to PROFILE_DIR:
+# - callbacks named in PROFILE_CALLBACKS (e.g. 'update_slices'), always;
+# - any callback request with the header "X-Profile: 1" from a
+#   METRICS_CLIENTS address, if PROFILE_HEADER_ENABLED;
+# - every call of the dash_graphing_functions named in PROFILE_FUNCTIONS
+#   (e.g. 'write_summary'), including those in background jobs.
+# PROFILE_TRACE_MEMORY also saves allocation traces from tracemalloc. It
+# traces every thread while a capture runs, slowing the whole server down
+# (slice renders take about 5x longer with profiling.TRACE_FRAMES = 2, and
+# 60-80x longer with 16 frames), so leave it off outside of debugging.
+PROFILE_DIR = os.path.join(tempfile.gettempdir(), 'volume-viewer-profiles')
+PROFILE_KEEP = 20
+PROFILE_CALLBACKS = set()
+PROFILE_HEADER_ENABLED = False
+PROFILE_FUNCTIONS = set()
+PROFILE_TRACE_MEMORY = False
+
+volume_registry = VolumeRegistry(VOLUME_CACHE_BYTES)
+slice_cache = LRUCache(SLICE_CACHE_BYTES)
+slice_prefetcher = Prefetcher(max_workers=PREFETCH_WORKERS)
+slider_coalescer = RequestCoalescer(SLIDER_SETTLE_SECONDS)
+job_manager = JobManager(max_workers=JOB_WORKERS)
+profile_store = profiling.CaptureStore(PROFILE_DIR, keep=PROFILE_KEEP)
+# the export pool is created on first use, from any thread or WSGI worker
+kaleido_pool.POOL_SIZE = KALEIDO_POOL_SIZE
+
+for _name in PROFILE_FUNCTIONS:
+    setattr(dash_graph, _name,
+            profiling.profiled(profile_store, getattr(dash_graph, _name),
+                               trace_memory=PROFILE_TRACE_MEMORY))
+
+
+def figure_payload(fig):
+    '''
+    Figure as returned to the browser (see BINARY_FIGURES)
+    '''
+    if BINARY_FIGURES:
+        return binary_figure(fig)
+    return fig
+
+
+def lookup_volume(volume_handle):
+    '''
+    Look up the volume referenced by the handle in the intermediate-value
+    store. Volumes evicted from the registry are reloaded from their source.
+    Args:
+        volume_handle(dict): as returned by VolumeRegistry.register
+    Returns:
+        numpy 3D array (shared, not a copy)
+    '''
+    if volume_handle is None:
+        raise PreventUpdate
+
+    volume = volume_registry.get(volume_handle["dataset_id"])
+    if volume is None:
+        volume = misc.load_volume(volume_handle["source"], mmap_mode='r')
+        volume_registry.register(volume,
+                                 dataset_id=volume_handle["dataset_id"],
+                                 source=volume_handle["source"])
+    return volume
+
+
+def lookup_stats(volume_handle):
+    '''
+    Intensity statistics of the volume referenced by the handle, computed
+    once per volume and shared by all callbacks
+    Returns:
+        VolumeStats
+    '''
+    volume = lookup_volume(volume_handle)
+    stats = volume_registry.get_derived(volume_handle["dataset_id"], 'stats',
+                                        VolumeStats.from_array)
+    if stats is None:  # evicted in the meantime
+        stats = VolumeStats.from_array(volume)
+    return stats
+
+
+def lookup_pyramid(volume_handle):
+    '''
+    Downsampled levels of the volume referenced by the handle, built once
+    per volume
+    Returns:
+        VolumePyramid
+    '''
+    volume = lookup_volume(volume_handle)
+    pyramid = volume_registry.get_derived(volume_handle["dataset_id"], 'pyramid',
+                                          VolumePyramid.build)
+    if pyramid is None:  # evicted in the meantime
+        pyramid = VolumePyramid.build(volume)
+    return pyramid
+
+
+def lookup_projections(volume_handle, method):
+    '''
+    Intensity projections of the volume referenced by the handle, computed
+    once per volume and method
+    Args:
+        volume_handle(dict):
+        method(str): 'max', 'mean' or 'min'
+    Returns:
+        VolumeProjections
+    '''
+    def build(volume):
+        with metrics.stage('projection', method):
+            return VolumeProjections.build(volume, method=method)
+
+    volume = lookup_volume(volume_handle)
+    projection = volume_registry.get_derived(volume_handle["dataset_id"],
+                                             f'projection-{method}', build)
+    if projection is None:  # evicted in the meantime
+        projection = build(volume)
+    return projection
 
 
 #############################################
@@ -30,7 +210,7 @@ controls_2d = dbc.Card(
                 dbc.Label("Colormap"),
                 dcc.Dropdown(
                     id="colormap",
-                    options=['rainbow', 'viridis', 'gray'],
+                    options=colormaps.COLORMAPS,
                     value='rainbow',
                 ),
             ]
@@ -48,6 +228,20 @@ controls_2d = dbc.Card(
                 dbc.Input(id="min_percent", type="number", value=8, min=1, max=100),
             ]
         ),
+        html.Div(
+            [
+                dbc.Label("Projection"),
+                # off by default: a projection is a full pass over the volume,
+                # so it is only computed once a method is selected
+                dcc.Dropdown(
+                    id="projection",
+                    options=[{'label': f"{method} intensity", 'value': method}
+                             for method in PROJECTIONS],
+                    value=None,
+                    placeholder="off",
+                ),
+            ]
+        ),
     ],
     body=True,
     style={'margin': 10} 
@@ -61,7 +255,7 @@ controls_3d = dbc.Card(
                 dbc.Label("Colorscale"),
                 dcc.Dropdown(
                     id="colorscale_3d",
-                    options=['rainbow', 'viridis', 'gray'],
+                    options=colormaps.COLORMAPS,
                     value='rainbow',
                 ),
             ]
@@ -80,8 +274,19 @@ controls_3d = dbc.Card(
             ]
         ),
         html.Div(
-             dbc.Button(id='3d-request', style={'margin': 10}, n_clicks=0, children='3D Volume rendering')
-        )
+            [
+                dbc.Label("Voxel budget"),
+                dbc.Input(id="voxel-budget", type="number", value=DEFAULT_VOXEL_BUDGET,
+                          min=MIN_LEVEL_VOXELS, step=1000),
+            ]
+        ),
+        html.Div(
+            [
+                dbc.Button(id='3d-request', style={'margin': 10}, n_clicks=0, children='3D Volume rendering'),
+                dbc.Button(id='3d-refine', style={'margin': 10}, n_clicks=0, children='Refine'),
+            ]
+        ),
+        dcc.Store(id='plotly-vol-level'),
         
     ],
     body=True,
@@ -95,7 +300,10 @@ download_buttons = dbc.Card(
         dbc.Button(id='btn-download-2d', style={'margin': 10}, n_clicks=0, children='Download 2D'),
         dcc.Download(id='download-2d'),
         dbc.Button(id='btn-download-3d', style={'margin': 10}, n_clicks=0, children='Download 3D'),
-        dcc.Download(id='download-3d')
+        dcc.Download(id='download-3d'),
+        html.Div(id='job-status', style={'margin': 10}),
+        dbc.Button(id='btn-cancel-jobs', style={'margin': 10}, n_clicks=0, children='Cancel',
+                   color='secondary'),
     ],
     body=True,
     style={'margin': 10}
@@ -103,64 +311,243 @@ download_buttons = dbc.Card(
 
 ########################
 
-app = Dash(external_stylesheets=[dbc.themes.BOOTSTRAP])
+app = Dash(external_stylesheets=[dbc.themes.BOOTSTRAP],
+           external_scripts=[PLOTLY_JS_URL] if BINARY_FIGURES else [])
 app.config.suppress_callback_exceptions = True
 
-app.layout = dbc.Container(
-    [
-        html.H1('3D Volume Visualizer', style={'margin': 10}),
-        html.Hr(),
-        html.Br(),
-        html.Div(
-            [
-                dbc.Label("Input Dataset"),
-                dbc.Input(id="dataset", type="text", required=True, 
-                    placeholder="path/to/dir/containing/tif/files"),
-                dbc.Button(id='submit-button-state', style={'margin': 10}, n_clicks=0, children='Submit'),
-                html.Div(id='dataset-selection')
-            ], 
-        ),
-        dcc.Store(id='intermediate-value'),
-        html.Br(),
-        html.Br(),
-        dbc.Row(
+
+def slice_templates():
+    '''
+    Data for the clientside slice callbacks: the URL of the slice endpoint
+    and an empty slice figure per colormap, so that the browser renders
+    exactly what render_slice_view would
+    '''
+    empty = np.zeros((1, 1), dtype=np.uint8)
+    figures = {colormap: dash_graph.render_slice_view(empty, 0, 1, colormap).to_plotly_json()
+               for colormap in colormaps.COLORMAPS}
+
+    return {"slice_url": app.get_relative_path('/volumes/'),
+            "figures": figures}
+
+
+def slice_row(axis):
+    # the slice and, next to it, the projection along the same axis
+    return dbc.Row([
+        dbc.Col(dcc.Graph(id=f'{axis}-slice')),
+        dbc.Col(dcc.Graph(id=f'{axis}-projection'), id=f'{axis}-projection-col',
+                style={'display': 'none'}),
+    ])
+
+
+def serve_layout():
+    return dbc.Container(
         [
-        dbc.Col(
-            
-                dbc.Row(
-                    [
-                    dcc.Graph(id='x-slice'),
-                    html.Div(id='x_slider_display'),
-                    html.Hr(),
-                    dcc.Graph(id='y-slice'),
-                    html.Div(id='y_slider_display'),
-                    html.Hr(),
-                    dcc.Graph(id='z-slice'),
-                    html.Div(id='z_slider_display'),
-                    html.Hr(),
-                    ],
-                    align="center",
-                ),
-                md=7
-        ),
-        dbc.Col([
-            dbc.Row(controls_2d), 
-            dbc.Row(download_buttons)
-            ],
-            md=5
-        ),
-        ]),
-        html.Br(),
-        html.Br(),
-        dbc.Row([
+            html.H1('3D Volume Visualizer', style={'margin': 10}),
+            html.Hr(),
+            html.Br(),
+            html.Div(
+                [
+                    dbc.Label("Input Dataset"),
+                    dbc.Input(id="dataset", type="text", required=True, 
+                        placeholder="path/to/dir/containing/tif/files"),
+                    dbc.Button(id='submit-button-state', style={'margin': 10}, n_clicks=0, children='Submit'),
+                    html.Div(id='dataset-selection')
+                ], 
+            ),
+            dcc.Store(id='intermediate-value'),
+            # new ID on every page load; used to coalesce slider updates
+            dcc.Store(id='session-id', data=uuid.uuid4().hex),
+            dcc.Interval(id='job-poll', interval=JOB_POLL_MS, disabled=True),
+            dcc.Store(id='slice-templates',
+                      data=slice_templates() if CLIENTSIDE_SLICES else None),
+            html.Br(),
+            html.Br(),
+            dbc.Row(
+            [
             dbc.Col(
-                dcc.Graph(id='plotly_vol'),
-                md=7
+            
+                    dbc.Row(
+                        [
+                        slice_row('x'),
+                        html.Div(id='x_slider_display'),
+                        html.Hr(),
+                        slice_row('y'),
+                        html.Div(id='y_slider_display'),
+                        html.Hr(),
+                        slice_row('z'),
+                        html.Div(id='z_slider_display'),
+                        html.Hr(),
+                        ],
+                        align="center",
+                    ),
+                    md=7
             ),
-            dbc.Col(controls_3d, md=5),
-        ])
-    ]
-)
+            dbc.Col([
+                dbc.Row(controls_2d), 
+                dbc.Row(download_buttons)
+                ],
+                md=5
+            ),
+            ]),
+            html.Br(),
+            html.Br(),
+            dbc.Row([
+                dbc.Col(
+                    dcc.Graph(id='plotly_vol'),
+                    md=7
+                ),
+                dbc.Col(controls_3d, md=5),
+            ])
+        ]
+    )
+
+
+app.layout = serve_layout
+
+
+### Metrics and profiling
+
+def callback_name(output):
+    '''
+    Name of the callback function behind a /_dash-update-component request
+    '''
+    callback = app.callback_map.get(output, {}).get('callback')
+    return getattr(callback, '__name__', None) or output
+
+
+def request_callback():
+    '''
+    Name of the callback the current request runs, or None if it is not a
+    callback request
+    '''
+    if not request.path.endswith('/_dash-update-component'):
+        return None
+    body = request.get_json(silent=True) or {}
+    return callback_name(body.get('output', 'unknown'))
+
+
+@app.server.before_request
+def start_profile_capture():
+    name = request_callback()
+    if name is None:
+        return
+    requested = PROFILE_HEADER_ENABLED and request.headers.get('X-Profile') == '1' \
+        and request.remote_addr in METRICS_CLIENTS
+    if name in PROFILE_CALLBACKS or requested:
+        g.profile_capture = contextlib.ExitStack()
+        g.profile_capture.enter_context(
+            profiling.capture(profile_store, name, trace_memory=PROFILE_TRACE_MEMORY))
+
+
+@app.server.teardown_request
+def finish_profile_capture(exc):
+    if 'profile_capture' in g:
+        g.pop('profile_capture').close()
+
+
+@app.server.before_request
+def start_callback_metrics():
+    if not METRICS_ENABLED:
+        return
+    name = request_callback()
+    if name is None:
+        return
+    g.metrics_callback = name
+    g.metrics_start = time.perf_counter()
+    if METRICS_TRACE_MEMORY and tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+        g.metrics_traced = tracemalloc.get_traced_memory()[0]
+
+
+@app.server.after_request
+def record_callback_metrics(response):
+    if 'metrics_callback' not in g:
+        return response
+
+    peak = None
+    if 'metrics_traced' in g:
+        peak = max(0, tracemalloc.get_traced_memory()[1] - g.metrics_traced)
+
+    metrics.registry.observe_callback(g.metrics_callback,
+                                      time.perf_counter() - g.metrics_start,
+                                      request.content_length or 0,
+                                      response.calculate_content_length() or 0,
+                                      peak_bytes=peak,
+                                      error=response.status_code >= 400)
+    return response
+
+
+@app.server.route('/metrics')
+def serve_metrics():
+    if request.remote_addr not in METRICS_CLIENTS:
+        abort(403)
+    return Response(metrics.registry.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+def render_slice_figure(volume_handle, axis, slice_n, colormap, max_percent,
+                        min_percent, window=None):
+    '''
+    2D slice figure, served from slice_cache when the same slice was
+    already rendered with the same colormap and window
+    Args:
+        volume_handle(dict):
+        axis(str): 'x', 'y' or 'z'
+        slice_n(int): slice number along the axis
+        colormap(str):
+        max_percent(float):
+        min_percent(float):
+        window(tuple): (zmin, zmax) for these percentiles, if already known
+    Returns:
+        figure payload (see figure_payload)
+    '''
+    key = (volume_handle["dataset_id"], axis, slice_n, colormap,
+           max_percent, min_percent)
+    fig = slice_cache.get(key)
+
+    if fig is None:
+        data_array = lookup_volume(volume_handle)
+        if window is None:
+            window = lookup_stats(volume_handle).window(min_percent, max_percent)
+        zmin, zmax = window
+
+        plane = dash_graph.renderable(misc.extract_slice(data_array, axis, slice_n))
+        fig = figure_payload(dash_graph.render_slice_view(plane, zmin, zmax, colormap))
+        # the figure holds one copy of the plane, which dominates its size
+        slice_cache.put(key, fig, plane.nbytes)
+
+    return fig
+
+
+def slice_figure(volume_handle, axis, slice_n, colormap, max_percent, min_percent,
+                 window=None):
+    '''
+    Slice figure for a callback. Waits for a prefetch of the same slice if
+    one is in flight, then queues the neighbouring slices along the axis
+    (see render_slice_figure for the arguments).
+    '''
+    scope = (volume_handle["dataset_id"], axis)
+    params = (colormap, max_percent, min_percent)
+
+    slice_prefetcher.wait(scope, (slice_n,) + params)
+    fig = render_slice_figure(volume_handle, axis, slice_n, *params, window=window)
+
+    # nearest slices first; this replaces (cancels) the queued prefetches
+    # of a previous position, colormap or window
+    axis_size = volume_handle["shape"]["xyz".index(axis)]
+    neighbours = sorted(range(max(0, slice_n - PREFETCH_RADIUS),
+                              min(axis_size, slice_n + PREFETCH_RADIUS + 1)),
+                        key=lambda n: abs(n - slice_n))
+    tasks = {}
+    for n in neighbours:
+        key = (volume_handle["dataset_id"], axis, n) + params
+        if n != slice_n and key not in slice_cache:
+            tasks[(n,) + params] = functools.partial(
+                render_slice_figure, volume_handle, axis, n, *params)
+    slice_prefetcher.prefetch(scope, tasks)
+
+    return fig
+
 
 ### Callbacks for Dataset selection
 
@@ -174,19 +561,25 @@ def get_array(n_clicks, data_path):
     if n_clicks is None:
         raise PreventUpdate
     else:
+        dataset_id = misc.dataset_id(data_path)
+        volume = volume_registry.get(dataset_id)
 
-        if Path(data_path).suffix == ".npy":
-            volume = misc.numpy_binary_to_array(data_path)
+        if volume is None:
+            volume = misc.load_volume(data_path, mmap_mode='r')
 
-        elif Path(data_path).is_dir:
-            volume = misc.stack_to_array(data_path)
-        
-        else:
-            print("Incorrect input")
-            volume = np.zeros((1,1,1))
-        
-        encoded_array_data = json.dumps({"volume": volume}, cls=NumpyArrayEncoder)
-        return encoded_array_data
+        volume_handle = volume_registry.register(volume,
+                                                 dataset_id=dataset_id,
+                                                 source=data_path)
+        # build the percentile index up front so slider moves stay cheap;
+        # the clientside slice callbacks interpolate in this table
+        stats = lookup_stats(volume_handle)
+        volume_handle["percentiles"] = [stats.percentile(q) for q in range(101)]
+        # the 3D pyramid is built in the background; a 3D request made
+        # before it is ready waits for it
+        threading.Thread(target=lookup_pyramid, args=(volume_handle,),
+                         daemon=True).start()
+
+        return volume_handle
 
 
 ## Print the size of the selected volume array
@@ -195,169 +588,406 @@ def get_array(n_clicks, data_path):
     Input(component_id='intermediate-value', component_property='data'),    
     prevent_initial_call=True
 )
-def print_volume_size(jsonified_volume):
-    decoded_array = json.loads(jsonified_volume)
-    data_array = np.asarray(decoded_array["volume"])
+def print_volume_size(volume_handle):
     
-    return f"volume shape: {np.shape(data_array)}"
+    return f"volume shape: {tuple(volume_handle['shape'])}"
 
 
 
 ### Callbacks for 2D sliders
 
-@app.callback(
-    Output(component_id='x_slider_display', component_property='children'),
-    Input(component_id='intermediate-value', component_property='data'),    
-    prevent_initial_call=True
-)
-def set_x_slider(jsonified_volume):
-    
-    decoded_array = json.loads(jsonified_volume)
-    data_array = np.asarray(decoded_array["volume"])
-
+def axis_slider(axis, axis_size):
     return dcc.Slider(
            min=0,
-           max=(np.shape(data_array)[0])-1,
+           max=axis_size-1,
            step=1,
-           marks={i: f'{i}' for i in range(np.shape(data_array)[0]) if i%5==0},
+           marks={i: f'{i}' for i in range(axis_size) if i%5==0},
            value=0,
-           id='x_slider'
+           updatemode='drag',
+           id=f'{axis}_slider'
            )
 
+
 @app.callback(
+    Output(component_id='x_slider_display', component_property='children'),
     Output(component_id='y_slider_display', component_property='children'),
+    Output(component_id='z_slider_display', component_property='children'),
     Input(component_id='intermediate-value', component_property='data'),    
     prevent_initial_call=True
 )
-def set_y_slider(jsonified_volume):
+def set_sliders(volume_handle):
     
-    decoded_array = json.loads(jsonified_volume)
-    data_array = np.asarray(decoded_array["volume"])
+    return [axis_slider(axis, axis_size)
+            for axis, axis_size in zip('xyz', volume_handle["shape"])]
 
-    return dcc.Slider(
-           min=0,
-           max=(np.shape(data_array)[1])-1,
-           step=1,
-           marks={i: f'{i}' for i in range(np.shape(data_array)[1]) if i%5==0},
-           value=0,
-           id='y_slider'
-           )
 
-@app.callback(
-    Output(component_id='z_slider_display', component_property='children'),
-    Input(component_id='intermediate-value', component_property='data'),    
-    prevent_initial_call=True
-)
-def set_z_slider(jsonified_volume):
-    
-    decoded_array = json.loads(jsonified_volume)
-    data_array = np.asarray(decoded_array["volume"])
+#### Callbacks for 2D slices
 
-    return dcc.Slider(
-           min=0,
-           max=(np.shape(data_array)[2])-1,
-           step=1,
-           marks={i: f'{i}' for i in range(np.shape(data_array)[2]) if i%5==0},
-           value=0,
-           id='z_slider'
-           )
 
+if CLIENTSIDE_SLICES:
+    app.clientside_callback(
+        ClientsideFunction(namespace='slices', function_name='render_slices'),
+        Output(component_id='x-slice', component_property='figure'),
+        Output(component_id='y-slice', component_property='figure'),
+        Output(component_id='z-slice', component_property='figure'),
+        Input(component_id='intermediate-value', component_property='data'),
+        Input(component_id='x_slider', component_property='value'),
+        Input(component_id='y_slider', component_property='value'),
+        Input(component_id='z_slider', component_property='value'),
+        Input(component_id='colormap', component_property='value'),
+        Input(component_id='max_percent', component_property='value'),
+        Input(component_id='min_percent', component_property='value'),
+        State(component_id='slice-templates', component_property='data'),
+        prevent_initial_call=True,
+    )
 
-#### Callbacks for 2D slices
+else:
+    @app.callback(
+        Output(component_id='x-slice', component_property='figure'),
+        Output(component_id='y-slice', component_property='figure'),
+        Output(component_id='z-slice', component_property='figure'),
+        Input(component_id='intermediate-value', component_property='data'),
+        Input(component_id='x_slider', component_property='value'),
+        Input(component_id='y_slider', component_property='value'),
+        Input(component_id='z_slider', component_property='value'),
+        Input(component_id='colormap', component_property='value'),
+        Input(component_id='max_percent', component_property='value'),
+        Input(component_id='min_percent', component_property='value'),
+        State(component_id='session-id', component_property='data'),
+        prevent_initial_call=True, 
+    )
+    def update_slices(volume_handle, x_slice_n, y_slice_n, z_slice_n, colormap,
+                      max_percent, min_percent, session_id):
+        # a slider move only redraws its own axis; anything else redraws all
+        triggered = set(ctx.triggered_prop_ids.values())
+        slider_axes = {axis for axis in 'xyz' if f'{axis}_slider' in triggered}
+        dragging = bool(triggered) and not triggered - {f'{axis}_slider' for axis in 'xyz'}
+        if not dragging:
+            slider_axes = set('xyz')
 
+        # while dragging, only the newest request per session and axis is
+        # rendered; older ones give way as soon as a newer one arrives
+        tickets = {}
+        if dragging:
+            tickets = {axis: slider_coalescer.submit((session_id, axis))
+                       for axis in slider_axes}
+        try:
+            if dragging:
+                slider_axes = {axis for axis in slider_axes
+                               if slider_coalescer.settle((session_id, axis), tickets[axis])}
+                if not slider_axes:
+                    raise PreventUpdate
 
-@app.callback(
-    Output(component_id='x-slice', component_property='figure'),
-    Input(component_id='intermediate-value', component_property='data'),
-    Input(component_id='x_slider', component_property='value'),
-    Input(component_id='colormap', component_property='value'),
-    Input(component_id='max_percent', component_property='value'),
-    Input(component_id='min_percent', component_property='value'),
-    prevent_initial_call=True, 
-    
-)
-def update_x_slice(jsonified_volume, slice_n, colormap, max_percent, min_percent):
-    decoded_array = json.loads(jsonified_volume)
-    data_array = np.asarray(decoded_array["volume"])
+            # one volume lookup and one window for all three figures
+            window = lookup_stats(volume_handle).window(min_percent, max_percent)
 
-    
-    return px.imshow(data_array[slice_n,:,:], 
-                    zmin=np.percentile(data_array, min_percent), 
-                    zmax=np.percentile(data_array, max_percent),
-                    color_continuous_scale=colormap)
+            figures = []
+            for axis, slice_n in zip('xyz', (x_slice_n, y_slice_n, z_slice_n)):
+                if axis in slider_axes:
+                    fig = slice_figure(volume_handle, axis, slice_n, colormap,
+                                       max_percent, min_percent, window=window)
+                    # drop the result if a newer request overtook this render
+                    if axis in tickets and \
+                            not slider_coalescer.is_current((session_id, axis), tickets[axis]):
+                        fig = no_update
+                    figures.append(fig)
+                else:
+                    figures.append(no_update)
 
-@app.callback(
-    Output(component_id='y-slice', component_property='figure'),
-    Input(component_id='intermediate-value', component_property='data'),
-    Input(component_id='y_slider', component_property='value'),
-    Input(component_id='colormap', component_property='value'),
-    Input(component_id='max_percent', component_property='value'),
-    Input(component_id='min_percent', component_property='value'),
-    prevent_initial_call=True, 
-)
-def update_y_slice(jsonified_volume, slice_n, colormap, max_percent, min_percent):
-    decoded_array = json.loads(jsonified_volume)
-    data_array = np.asarray(decoded_array["volume"])
+            if all(fig is no_update for fig in figures):
+                raise PreventUpdate
+            return figures
+        finally:
+            # forget the keys of finished drags
+            for axis in tickets:
+                slider_coalescer.finish((session_id, axis))
+
+
+### Callbacks for intensity projections
 
-    return px.imshow(data_array[:,slice_n,:], 
-                    zmin=np.percentile(data_array, min_percent), 
-                    zmax=np.percentile(data_array, max_percent),
-                    color_continuous_scale=colormap)
+def projection_figure(volume_handle, axis, method, colormap, max_percent,
+                      min_percent):
+    '''
+    Figure of the projection along an axis, windowed by the percentiles of
+    the projection itself; cached in slice_cache like the slice figures
+    Returns:
+        figure payload (see figure_payload)
+    '''
+    key = (volume_handle["dataset_id"], axis, f'{method} projection', colormap,
+           max_percent, min_percent)
+    fig = slice_cache.get(key)
+
+    if fig is None:
+        plane = dash_graph.renderable(lookup_projections(volume_handle, method)[axis])
+        zmin, zmax = np.percentile(plane, [min_percent, max_percent])
+        fig = dash_graph.render_slice_view(plane, zmin, zmax, colormap)
+        fig.update_layout(title=f"{method} intensity projection along {axis}")
+        fig = figure_payload(fig)
+        slice_cache.put(key, fig, plane.nbytes)
+
+    return fig
 
 
 @app.callback(
-    Output(component_id='z-slice', component_property='figure'),
+    Output(component_id='x-projection', component_property='figure'),
+    Output(component_id='y-projection', component_property='figure'),
+    Output(component_id='z-projection', component_property='figure'),
+    Output(component_id='x-projection-col', component_property='style'),
+    Output(component_id='y-projection-col', component_property='style'),
+    Output(component_id='z-projection-col', component_property='style'),
     Input(component_id='intermediate-value', component_property='data'),
-    Input(component_id='z_slider', component_property='value'),
+    Input(component_id='projection', component_property='value'),
     Input(component_id='colormap', component_property='value'),
     Input(component_id='max_percent', component_property='value'),
     Input(component_id='min_percent', component_property='value'),
-    prevent_initial_call=True, 
+    prevent_initial_call=True,
 )
-def update_z_slice(jsonified_volume, slice_n, colormap, max_percent, min_percent):
-    decoded_array = json.loads(jsonified_volume)
-    data_array = np.asarray(decoded_array["volume"])
+def update_projections(volume_handle, method, colormap, max_percent, min_percent):
+    if volume_handle is None:
+        raise PreventUpdate
+    if method is None:
+        hidden = {'display': 'none'}
+        return [no_update] * 3 + [hidden] * 3
 
-    return px.imshow(data_array[:,:,slice_n], 
-                    zmin=np.percentile(data_array, min_percent), 
-                    zmax=np.percentile(data_array, max_percent),
-                    color_continuous_scale=colormap)
+    # all three axes come from a single pass over the volume
+    figures = [projection_figure(volume_handle, axis, method, colormap,
+                                 max_percent, min_percent)
+               for axis in 'xyz']
+    return figures + [{}] * 3
 
 
 ### Callback for 3D Plotly volume rendering
 
+def render_3d_job(volume_handle, colorscale, opacity, surface_n, max_pct, min_pct,
+                  voxel_budget, refine_level=None, progress=None):
+    '''
+    Job function for the interactive 3D view
+    Args:
+        refine_level(int): pyramid level currently displayed when Refine
+                           was clicked; None to pick the level from the budget
+        progress(callable): progress(done, total) callback of the job
+    Returns:
+        (figure payload, pyramid level)
+    '''
+    with metrics.stage('render_3d_job', 'decode'):
+        pyramid = lookup_pyramid(volume_handle)
+    if progress:
+        progress(1, 2)
+
+    if refine_level is not None:
+        # one level finer than what is currently displayed
+        level = max(0, refine_level - 1)
+    else:
+        level = pyramid.level_for_budget(voxel_budget or DEFAULT_VOXEL_BUDGET)
+
+    factor, data_array = pyramid.levels[level]
+    name = '3D volume' if factor == 1 else f'3D volume ({factor}x downsampled)'
+
+    fig = dash_graph.render_plotly_volume_view(data_array,
+                                        name=name,
+                                        voxel_step=factor,
+                                        stats=lookup_stats(volume_handle),
+                                        colorscale=colorscale,
+                                        opacity=opacity,
+                                        opacityscale=opacity,
+                                        surface_count=surface_n,
+                                        max_pct=max_pct,
+                                        min_pct=min_pct) 
+    with metrics.stage('render_3d_job', 'payload'):
+        payload = figure_payload(fig)
+    return payload, level
+
+
 @app.callback(
-    Output(component_id='plotly_vol', component_property='figure'),
+    Output(component_id='job-poll', component_property='disabled', allow_duplicate=True),
     Input(component_id='3d-request', component_property='n_clicks'),
+    Input(component_id='3d-refine', component_property='n_clicks'),
     State(component_id='intermediate-value', component_property='data'),
     State(component_id='colorscale_3d', component_property='value'),
     State(component_id='opacity', component_property='value'),
     State(component_id='surface-count', component_property='value'),
     State(component_id='max_percent', component_property='value'),
     State(component_id='min_percent', component_property='value'),
+    State(component_id='voxel-budget', component_property='value'),
+    State(component_id='plotly-vol-level', component_property='data'),
+    State(component_id='session-id', component_property='data'),
     prevent_initial_call=True
 )
-def update_plotly_3D(n_clicks, jsonified_volume, colorscale, opacity, 
-                    surface_n, max_pct, min_pct):
-    if n_clicks is None:
+def update_plotly_3D(n_clicks, refine_clicks, volume_handle, colorscale, opacity, 
+                    surface_n, max_pct, min_pct, voxel_budget, current_level,
+                    session_id):
+    if n_clicks is None or volume_handle is None:
         raise PreventUpdate
     else:
-        decoded_array = json.loads(jsonified_volume)
-        data_array = np.asarray(decoded_array["volume"])
+        refine_level = None
+        if ctx.triggered_id == '3d-refine':
+            if current_level is None:
+                raise PreventUpdate
+            refine_level = current_level
+
+        job_manager.submit(session_id, 'plotly_vol', '3D rendering', render_3d_job,
+                           volume_handle, colorscale, opacity, surface_n,
+                           max_pct, min_pct, voxel_budget, refine_level)
+        # start polling for the result
+        return False
+
+
+### Binary slice endpoint (used by the clientside slice callbacks)
+
+# only registered with the clientside slices that fetch from it
+if CLIENTSIDE_SLICES:
+    @app.server.route('/volumes/<dataset_id>/<axis>/<int:index>')
+    def serve_slice(dataset_id, axis, index):
+        '''
+        One plane of a registered volume as raw little-endian uint8/uint16
+        (float32 for float volumes), deflate-compressed when the client
+        accepts it. X-Slice-Offset and X-Slice-Scale map the values back to
+        intensities (see compact_plane).
+        '''
+        # evicted volumes are reloaded like in lookup_volume
+        source = volume_registry.source(dataset_id)
+        if axis not in ('x', 'y', 'z') or \
+                (source is None and dataset_id not in volume_registry):
+            abort(404)
+        volume_handle = {"dataset_id": dataset_id, "source": source}
+        volume = lookup_volume(volume_handle)
+
+        axis_size = volume.shape['xyz'.index(axis)]
+        if not 0 <= index < axis_size:
+            abort(404)
+
+        stats = lookup_stats(volume_handle)
+        plane, offset, scale = compact_plane(misc.extract_slice(volume, axis, index),
+                                             stats.min, stats.max)
+        body = plane.astype(plane.dtype.newbyteorder('<'), copy=False).tobytes()
+
+        headers = {"X-Slice-Shape": f"{plane.shape[0]},{plane.shape[1]}",
+                   "X-Slice-Dtype": plane.dtype.name,
+                   "X-Slice-Offset": repr(offset),
+                   "X-Slice-Scale": repr(scale),
+                   # dataset IDs change whenever the source file changes
+                   "Cache-Control": "private, max-age=3600"}
+        if 'deflate' in request.headers.get('Accept-Encoding', ''):
+            body = zlib.compress(body, 1)
+            headers["Content-Encoding"] = "deflate"
 
-        return dash_graph.render_plotly_volume_view(data_array,
-                                            colorscale=colorscale,
-                                            opacity=opacity,
-                                            opacityscale=opacity,
-                                            surface_count=surface_n,
-                                            max_pct=max_pct,
-                                            min_pct=min_pct) 
+        return Response(body, mimetype='application/octet-stream', headers=headers)
+
+
+@app.server.route('/exports/<name>')
+def serve_export(name):
+    '''
+    Streams an export file too large for the Download component from disk
+    '''
+    # export files are named <random hex>-<download name>
+    return send_from_directory(EXPORT_DIR, name, as_attachment=True,
+                               download_name=name.split('-', 1)[-1])
 
 
 ### Callbacks for Image downloading 
 
+def export_path(filename):
+    '''
+    A new file path in EXPORT_DIR. Exports older than the job expiry
+    (never downloaded, or too large to send) are removed first.
+    '''
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    now = time.time()
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > job_manager.max_age:
+                os.remove(path)
+        except OSError:
+            pass
+
+    return os.path.join(EXPORT_DIR, f"{uuid.uuid4().hex}-{filename}")
+
+
+def write_export(filename, write, *args, **kwargs):
+    '''
+    Call write(*args, path, **kwargs) to create an export file
+    Returns:
+        data for dcc.Download, or {"link", "filename"} for files larger
+        than SEND_FILE_MAX_BYTES, which are left for serve_export
+    '''
+    path = export_path(filename)
+    try:
+        write(*args, path, **kwargs)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+    if os.path.getsize(path) > SEND_FILE_MAX_BYTES:
+        return {"link": app.get_relative_path('/exports/' + os.path.basename(path)),
+                "filename": filename}
+
+    download = dcc.send_file(path, filename)
+    os.remove(path)
+    return download
+
+
+def summary_projections(volume_handle, method):
+    # the projection shown in the viewer, if any, is added to the exports
+    return [lookup_projections(volume_handle, method)] if method else []
+
+
+def export_all_job(volume_handle, colormap_2D, max_pct, min_pct, colorscale_3D,
+                   opacity, surface_n, projection=None, progress=None):
+    with metrics.stage('export_all_job', 'decode'):
+        data_array = lookup_volume(volume_handle)
+
+    return write_export("all_render.png", dash_graph.write_summary, data_array,
+                        stats=lookup_stats(volume_handle),
+                        min_pct=min_pct,
+                        max_pct = max_pct,
+                        colormap_2D = colormap_2D,
+                        colorscale_3D=colorscale_3D,
+                        opacity=opacity,
+                        opacityscale=opacity,
+                        surface_count=surface_n,
+                        projections=summary_projections(volume_handle, projection),
+                        progress=progress)
+
+
+def export_2d_job(volume_handle, colormap_2D, max_pct, min_pct, projection=None,
+                  progress=None):
+    with metrics.stage('export_2d_job', 'decode'):
+        data_array = lookup_volume(volume_handle)
+
+    return write_export("2D_render.png", dash_graph.write_summary, data_array,
+                        stats=lookup_stats(volume_handle),
+                        min_pct=min_pct,
+                        max_pct = max_pct,
+                        colormap_2D = colormap_2D,
+                        include_3D=False,
+                        projections=summary_projections(volume_handle, projection),
+                        progress=progress)
+
+
+def export_3d_job(volume_handle, colorscale, opacity, surface_n, progress=None):
+    with metrics.stage('export_3d_job', 'decode'):
+        data_array = lookup_volume(volume_handle)
+
+    fig_3d = dash_graph.render_plotly_volume_view(data_array,
+                                        stats=lookup_stats(volume_handle),
+                                        colorscale=colorscale,
+                                        opacity=opacity,
+                                        opacityscale=opacity,
+                                        surface_count=surface_n) 
+    # a cancelled job stops here, before the Kaleido render
+    if progress:
+        progress(1, 2)
+
+    with metrics.stage('export_3d_job', 'kaleido'):
+        byte_array_3D = kaleido_pool.to_image(fig_3d, format="png")
+
+    return dcc.send_bytes(byte_array_3D, "3D_render.png")
+
+
 @app.callback(
-    Output("download-all", "data"),
+    Output(component_id='job-poll', component_property='disabled', allow_duplicate=True),
     Input("btn-download-all", "n_clicks"),
     State(component_id='intermediate-value', component_property='data'),
     State(component_id='colormap', component_property='value'),
@@ -366,90 +996,130 @@ def update_plotly_3D(n_clicks, jsonified_volume, colorscale, opacity,
     State(component_id='colorscale_3d', component_property='value'),
     State(component_id='opacity', component_property='value'),
     State(component_id='surface-count', component_property='value'),
+    State(component_id='projection', component_property='value'),
+    State(component_id='session-id', component_property='data'),
     prevent_initial_call=True,
 )
-def download_all(n_clicks, jsonified_volume, colormap_2D, max_pct, min_pct, 
-                colorscale_3D, opacity, surface_n):
-    #img = Image.open("./data/Globus_figure_3.png", mode='r')
-    #img_byte_arr = io.BytesIO()
-    #img.save(img_byte_arr, format='PNG')
-    #img_byte_arr = img_byte_arr.getvalue()
-    if n_clicks is None:
+def download_all(n_clicks, volume_handle, colormap_2D, max_pct, min_pct, 
+                colorscale_3D, opacity, surface_n, projection, session_id):
+    if n_clicks is None or volume_handle is None:
         raise PreventUpdate
     else:
-        decoded_array = json.loads(jsonified_volume)
-        data_array = np.asarray(decoded_array["volume"])
-
-        byte_array_all = dash_graph.generate_summary(data_array,
-                                            min_pct=min_pct,
-                                            max_pct = max_pct,
-                                            colormap_2D = colormap_2D,
-                                            colorscale_3D=colorscale_3D,
-                                            opacity=opacity,
-                                            opacityscale=opacity,
-                                            surface_count=surface_n) 
-        byte_array_all = byte_array_all.getvalue()
-
-        return dcc.send_bytes(byte_array_all, "all_render.png")
-
+        job_manager.submit(session_id, 'download-all', 'Download All', export_all_job,
+                           volume_handle, colormap_2D, max_pct, min_pct,
+                           colorscale_3D, opacity, surface_n, projection)
+        return False
 
 
 @app.callback(
-    Output("download-2d", "data"),
+    Output(component_id='job-poll', component_property='disabled', allow_duplicate=True),
     Input("btn-download-2d", "n_clicks"),
     State(component_id='intermediate-value', component_property='data'),
     State(component_id='colormap', component_property='value'),
     State(component_id='max_percent', component_property='value'),
     State(component_id='min_percent', component_property='value'),
+    State(component_id='projection', component_property='value'),
+    State(component_id='session-id', component_property='data'),
     prevent_initial_call=True,
 )
-def download_2d(n_clicks, jsonified_volume, colormap_2D, max_pct, min_pct):
-    if n_clicks is None:
+def download_2d(n_clicks, volume_handle, colormap_2D, max_pct, min_pct, projection,
+                session_id):
+    if n_clicks is None or volume_handle is None:
         raise PreventUpdate
     else:
-        decoded_array = json.loads(jsonified_volume)
-        data_array = np.asarray(decoded_array["volume"])
-
-        byte_array_2D = dash_graph.generate_2D_summary(data_array,
-                                            min_pct=min_pct,
-                                            max_pct = max_pct,
-                                            colormap = colormap_2D)
-        byte_array_2D = byte_array_2D.getvalue()
-
-        return dcc.send_bytes(byte_array_2D, "2D_render.png")
+        job_manager.submit(session_id, 'download-2d', 'Download 2D', export_2d_job,
+                           volume_handle, colormap_2D, max_pct, min_pct, projection)
+        return False
 
 
 @app.callback(
-    Output("download-3d", "data"),
+    Output(component_id='job-poll', component_property='disabled', allow_duplicate=True),
     Input("btn-download-3d", "n_clicks"),
     State(component_id='intermediate-value', component_property='data'),
     State(component_id='colorscale_3d', component_property='value'),
     State(component_id='opacity', component_property='value'),
     State(component_id='surface-count', component_property='value'),
+    State(component_id='session-id', component_property='data'),
     prevent_initial_call=True,
 )
-def download_3d(n_clicks, jsonified_volume, colorscale, opacity, surface_n):
+def download_3d(n_clicks, volume_handle, colorscale, opacity, surface_n, session_id):
 
-    if n_clicks is None:
+    if n_clicks is None or volume_handle is None:
         raise PreventUpdate
     else:
-        decoded_array = json.loads(jsonified_volume)
-        data_array = np.asarray(decoded_array["volume"])
+        job_manager.submit(session_id, 'download-3d', 'Download 3D', export_3d_job,
+                           volume_handle, colorscale, opacity, surface_n)
+        return False
+
+
+### Callbacks for background jobs
+
+@app.callback(
+    Output(component_id='plotly_vol', component_property='figure'),
+    Output(component_id='plotly-vol-level', component_property='data'),
+    Output("download-all", "data"),
+    Output("download-2d", "data"),
+    Output("download-3d", "data"),
+    Output(component_id='job-status', component_property='children'),
+    Output(component_id='job-poll', component_property='disabled'),
+    Input(component_id='job-poll', component_property='n_intervals'),
+    State(component_id='session-id', component_property='data'),
+    prevent_initial_call=True,
+)
+def poll_jobs(n_intervals, session_id):
+    results = {}
+    messages = []
+    finished, running = job_manager.poll(session_id)
+    for job in finished:
+        if job.status == 'done' and isinstance(job.result, dict) and "link" in job.result:
+            # large export, streamed by serve_export
+            messages.append(html.A(f"{job.description}: {job.result['filename']}",
+                                   href=job.result["link"]))
+        elif job.status == 'done':
+            results[job.target] = job.result
+        elif job.status == 'failed':
+            messages.append(f"{job.description} failed: {job.error}")
+        else:
+            messages.append(f"{job.description} cancelled")
+
+    for job in running:
+        messages.append(f"{job.description}: {job.status} ({job.progress:.0%})")
 
-        byte_array_3D = dash_graph.render_plotly_volume_view(data_array,
-                                            output_bytes = True,
-                                            colorscale=colorscale,
-                                            opacity=opacity,
-                                            opacityscale=opacity,
-                                            surface_count=surface_n) 
-        byte_array_3D = byte_array_3D.getvalue()
+    figure, level = results.get('plotly_vol', (no_update, no_update))
 
-        return dcc.send_bytes(byte_array_3D, "3D_render.png")
+    return (figure, level,
+            results.get('download-all', no_update),
+            results.get('download-2d', no_update),
+            results.get('download-3d', no_update),
+            [html.Div(message) for message in messages],
+            # stop polling once nothing is left to wait for
+            not running)
+
+
+@app.callback(
+    Output(component_id='job-poll', component_property='disabled', allow_duplicate=True),
+    Input(component_id='btn-cancel-jobs', component_property='n_clicks'),
+    State(component_id='session-id', component_property='data'),
+    prevent_initial_call=True,
+)
+def cancel_jobs(n_clicks, session_id):
+    for job in job_manager.jobs_of(session_id):
+        job_manager.cancel(job.id)
+    # keep polling to report the cancellation
+    return False
 
 
 ########### End of Callbacks #############
 
 
 if __name__ == '__main__':
+    if METRICS_ENABLED and METRICS_TRACE_MEMORY:
+        tracemalloc.start()
+
+    pool = kaleido_pool.default_pool()
+    if pool is not None:
+        # start the renderers in the background so the first export is fast
+        threading.Thread(target=pool.warm_up, daemon=True).start()
+
     app.run_server(debug=True)
 
@@ -0,0 +1,112 @@
+// Clientside rendering of the 2D slices (CLIENTSIDE_SLICES in app.py).
+// Each plane is fetched once from the binary slice endpoint; colormap and
+// window changes are applied here without a server round trip.
+
+(function () {
+    const MAX_CACHED_PLANES = 64;
+    const planeCache = new Map();  // url -> Promise of {rows, cols, values}
+
+    function fetchPlane(url) {
+        if (planeCache.has(url)) {
+            // refresh the entry so that it is evicted last
+            const cached = planeCache.get(url);
+            planeCache.delete(url);
+            planeCache.set(url, cached);
+            return cached;
+        }
+
+        // the endpoint sends Content-Encoding: deflate, which fetch decodes
+        const request = fetch(url).then(function (response) {
+            if (!response.ok) {
+                throw new Error('slice request failed: ' + response.status);
+            }
+            const shape = response.headers.get('X-Slice-Shape').split(',').map(Number);
+            const dtype = response.headers.get('X-Slice-Dtype');
+            const offset = Number(response.headers.get('X-Slice-Offset'));
+            const scale = Number(response.headers.get('X-Slice-Scale'));
+
+            return response.arrayBuffer().then(function (buffer) {
+                const raw = dtype === 'uint8' ? new Uint8Array(buffer)
+                          : dtype === 'float32' ? new Float32Array(buffer)
+                          : new Uint16Array(buffer);
+                let values = raw;
+                if (offset !== 0 || scale !== 1) {
+                    values = new Float64Array(raw.length);
+                    for (let i = 0; i < raw.length; i++) {
+                        values[i] = offset + raw[i] * scale;
+                    }
+                }
+                return {rows: shape[0], cols: shape[1], values: values};
+            });
+        });
+
+        request.catch(function () { planeCache.delete(url); });
+        planeCache.set(url, request);
+        if (planeCache.size > MAX_CACHED_PLANES) {
+            planeCache.delete(planeCache.keys().next().value);
+        }
+        return request;
+    }
+
+    // Linear interpolation in the handle's 0..100 percentile table
+    function percentile(table, q) {
+        q = Math.min(Math.max(Number(q), 0), 100);
+        const lower = Math.floor(q);
+        if (lower >= table.length - 1) {
+            return table[table.length - 1];
+        }
+        return table[lower] + (q - lower) * (table[lower + 1] - table[lower]);
+    }
+
+    function renderSlice(axis, volumeHandle, sliceN, colormap, maxPercent,
+                         minPercent, templates) {
+        if (!volumeHandle || sliceN === undefined || sliceN === null) {
+            return window.dash_clientside.no_update;
+        }
+
+        const url = templates.slice_url + volumeHandle.dataset_id + '/' + axis
+                    + '/' + sliceN;
+
+        return fetchPlane(url).then(function (plane) {
+            const z = new Array(plane.rows);
+            for (let r = 0; r < plane.rows; r++) {
+                z[r] = Array.from(plane.values.subarray(r * plane.cols,
+                                                        (r + 1) * plane.cols));
+            }
+
+            // the templates are px.imshow figures built on the server
+            const fig = JSON.parse(JSON.stringify(templates.figures[colormap]));
+            fig.data[0].z = z;
+            fig.layout.coloraxis.cmin = percentile(volumeHandle.percentiles, minPercent);
+            fig.layout.coloraxis.cmax = percentile(volumeHandle.percentiles, maxPercent);
+            return fig;
+        });
+    }
+
+    // One callback for the three graphs: a slider move only redraws its own
+    // axis, any other input (volume, colormap, window) redraws all three
+    function renderSlices(volumeHandle, xSliceN, ySliceN, zSliceN, colormap,
+                          maxPercent, minPercent, templates) {
+        const noUpdate = window.dash_clientside.no_update;
+        const triggered = window.dash_clientside.callback_context.triggered
+            .map(function (trigger) { return trigger.prop_id.split('.')[0]; });
+        const sliderOnly = triggered.every(function (id) {
+            return ['x_slider', 'y_slider', 'z_slider'].includes(id);
+        });
+
+        const sliceNs = {x: xSliceN, y: ySliceN, z: zSliceN};
+        return Promise.all(['x', 'y', 'z'].map(function (axis) {
+            if (sliderOnly && !triggered.includes(axis + '_slider')) {
+                return noUpdate;
+            }
+            return renderSlice(axis, volumeHandle, sliceNs[axis], colormap,
+                               maxPercent, minPercent, templates);
+        }));
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        slices: {
+            render_slices: renderSlices,
+        },
+    });
+})();
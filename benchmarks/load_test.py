@@ -0,0 +1,382 @@
+'''
+Load test of a running viewer (python app.py) with concurrent simulated
+sessions. Each session talks to the Dash callback endpoint the way the
+browser does: it loads the layout, submits a dataset, scrubs the slice
+sliders, changes the colormap now and then, and triggers 3D renders and
+the 2D, All and 3D downloads, polling for their results like the job-poll
+interval. Every callback depending on a changed input is fired.
+
+    python benchmarks/load_test.py --dataset data/volume.npy --sessions 8 \
+        --duration 60 --scrub-rate 10 --url http://127.0.0.1:8050
+
+The report lists requests, errors, p50/p95/p99 latency and throughput per
+callback, and the turnaround of background jobs (submit to delivery).
+'''
+import argparse
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+
+# app.py callback functions by (first) output, for readable reports
+CALLBACK_NAMES = {
+    "intermediate-value.data": "get_array",
+    "dataset-selection.children": "print_volume_size",
+    "x_slider_display.children": "set_sliders",
+    "x-slice.figure": "update_slices",
+    "x-projection.figure": "update_projections",
+    "plotly_vol.figure": "poll_jobs",
+}
+JOB_CALLBACK_NAMES = {
+    "3d-request": "update_plotly_3D",
+    "btn-download-all": "download_all",
+    "btn-download-2d": "download_2d",
+    "btn-download-3d": "download_3d",
+    "btn-cancel-jobs": "cancel_jobs",
+}
+
+COLORMAPS = ['rainbow', 'viridis', 'gray']
+
+DOWNLOAD_BUTTONS = {
+    "2d": "btn-download-2d",
+    "all": "btn-download-all",
+    "3d": "btn-download-3d",
+}
+
+
+def parse_output(output):
+    '''
+    Dash output key ("a.b" or "..a.b...c.d..") to [(id, property), ...]
+    '''
+    if output.startswith('..'):
+        parts = output[2:-2].split('...')
+    else:
+        parts = [output]
+    return [tuple(part.rsplit('.', 1)) for part in parts]
+
+
+def walk_components(node):
+    '''
+    Yields every component (dict with props) in a layout or callback value
+    '''
+    if isinstance(node, list):
+        for child in node:
+            yield from walk_components(child)
+    elif isinstance(node, dict) and 'props' in node:
+        yield node
+        yield from walk_components(node['props'].get('children'))
+
+
+class Stats:
+    '''
+    Latencies and response sizes per callback, shared by all sessions
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.response_bytes = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.prevented = defaultdict(int)
+
+    def record(self, name, seconds, status, size):
+        with self.lock:
+            self.latencies[name].append(seconds)
+            self.response_bytes[name] += size
+            if status == 204:
+                self.prevented[name] += 1
+            elif status >= 400:
+                self.errors[name] += 1
+
+    def record_error(self, name):
+        with self.lock:
+            self.errors[name] += 1
+
+
+class Session:
+    '''
+    One simulated browser session
+    '''
+
+    def __init__(self, url, stats):
+        self.url = url.rstrip('/')
+        self.stats = stats
+        self.http = requests.Session()
+        self.values = {}  # (id, property) -> current value
+        self.clicks = itertools.count(1)
+
+        self.callbacks = {}  # first output -> dependency
+        for dependency in self.http.get(self.url + '/_dash-dependencies').json():
+            if dependency.get('clientside_function'):
+                continue
+            self.callbacks[dependency['output']] = dependency
+
+        layout = self.http.get(self.url + '/_dash-layout').json()
+        self.apply(layout)
+
+    def apply(self, value):
+        for component in walk_components(value):
+            props = component['props']
+            if isinstance(props.get('id'), str):
+                for prop, prop_value in props.items():
+                    self.values[(props['id'], prop)] = prop_value
+
+    def find(self, input_id):
+        '''
+        Returns:
+            [(output, dependency), ...] of every server callback triggered
+            by input_id; empty if none (e.g. the slices are rendered
+            clientside)
+        '''
+        return [(output, dependency) for output, dependency in self.callbacks.items()
+                if any(item['id'] == input_id for item in dependency['inputs'])]
+
+    def name(self, output, dependency):
+        first = "{}.{}".format(*parse_output(output)[0])
+        if first in CALLBACK_NAMES:
+            return CALLBACK_NAMES[first]
+        for item in dependency['inputs']:
+            if item['id'] in JOB_CALLBACK_NAMES:
+                return JOB_CALLBACK_NAMES[item['id']]
+        return output
+
+    def call(self, output, dependency, changed):
+        '''
+        Fire a callback after the inputs in changed ({(id, prop): value})
+        changed, and apply its response
+        Returns:
+            response JSON, or None
+        '''
+        self.values.update(changed)
+        outputs = [{"id": id_, "property": prop} for id_, prop in parse_output(output)]
+        body = {
+            "output": output,
+            "outputs": outputs if output.startswith('..') else outputs[0],
+            "inputs": [dict(item, value=self.values.get((item['id'], item['property'])))
+                       for item in dependency['inputs']],
+            "state": [dict(item, value=self.values.get((item['id'], item['property'])))
+                      for item in dependency['state']],
+            "changedPropIds": [f"{id_}.{prop}" for id_, prop in changed],
+        }
+
+        name = self.name(output, dependency)
+        start = time.perf_counter()
+        try:
+            response = self.http.post(self.url + '/_dash-update-component', json=body)
+        except requests.RequestException:
+            self.stats.record_error(name)
+            return None
+        self.stats.record(name, time.perf_counter() - start, response.status_code,
+                          len(response.content))
+
+        if response.status_code != 200:
+            return None
+        result = response.json()
+        for id_, props in result.get('response', {}).items():
+            for prop, value in props.items():
+                self.values[(id_, prop.split('@')[0])] = value
+                self.apply(value)
+        return result
+
+    def trigger(self, input_id, prop, value):
+        '''
+        Change an input and fire every callback that depends on it, like
+        the browser does
+        '''
+        self.values[(input_id, prop)] = value
+        for output, dependency in self.find(input_id):
+            self.call(output, dependency, {(input_id, prop): value})
+
+    def click(self, button_id):
+        self.trigger(button_id, 'n_clicks', next(self.clicks))
+
+    def submit(self, dataset):
+        self.values[('dataset', 'value')] = dataset
+        self.click('submit-button-state')
+        handle = self.values.get(('intermediate-value', 'data'))
+        if handle is None:
+            raise RuntimeError(f"the server could not load {dataset}")
+
+        # the renderer fires every callback with the store as input
+        self.trigger('intermediate-value', 'data', handle)
+        return handle
+
+    def poll_jobs(self):
+        if self.values.get(('job-poll', 'disabled'), True):
+            return
+        n = self.values.get(('job-poll', 'n_intervals')) or 0
+        self.trigger('job-poll', 'n_intervals', n + 1)
+
+
+def run_session(args, stats, jobs, stop, seed):
+    rng = random.Random(seed)
+    try:
+        session = Session(args.url, stats)
+        handle = session.submit(args.dataset)
+    except Exception as err:
+        print("session failed to start:", err, file=sys.stderr)
+        stats.record_error('session start')
+        return
+
+    shape = handle["shape"]
+    positions = {axis: size // 2 for axis, size in zip('xyz', shape)}
+    pending = {}  # button -> submit time
+    next_3d = time.monotonic() + rng.uniform(0, args.render_3d_every or 1)
+    next_download = time.monotonic() + rng.uniform(0, args.download_every or 1)
+    next_poll = time.monotonic()
+    downloads = itertools.cycle(args.downloads)
+    moves = 0
+
+    while not stop.is_set():
+        now = time.monotonic()
+
+        # scrub one slider by a few slices, like a drag
+        axis = rng.choice('xyz')
+        size = shape['xyz'.index(axis)]
+        positions[axis] = min(size - 1, max(0, positions[axis] + rng.randint(-4, 4)))
+        session.trigger(f'{axis}_slider', 'value', positions[axis])
+        moves += 1
+
+        if args.colormap_every and moves % args.colormap_every == 0:
+            session.trigger('colormap', 'value', rng.choice(COLORMAPS))
+
+        if args.render_3d_every and now >= next_3d and '3d-request' not in pending:
+            session.click('3d-request')
+            pending['3d-request'] = now
+            next_3d = now + args.render_3d_every
+
+        if args.download_every and args.downloads and now >= next_download:
+            # the download buttons take turns
+            button = DOWNLOAD_BUTTONS[next(downloads)]
+            if button not in pending:
+                session.click(button)
+                pending[button] = now
+            next_download = now + args.download_every
+
+        if now >= next_poll:
+            was_polling = not session.values.get(('job-poll', 'disabled'), True)
+            session.poll_jobs()
+            next_poll = now + args.poll_interval
+            if was_polling and session.values.get(('job-poll', 'disabled'), True):
+                # every pending job of the session has been delivered
+                with stats.lock:
+                    for button, submitted in pending.items():
+                        jobs[JOB_CALLBACK_NAMES[button]].append(time.monotonic() - submitted)
+                pending.clear()
+
+        stop.wait(1 / args.scrub_rate)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    index = (len(values) - 1) * q / 100
+    lower = int(index)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (index - lower) * (values[upper] - values[lower])
+
+
+def report(stats, jobs, elapsed):
+    rows = []
+    for name, latencies in sorted(stats.latencies.items()):
+        rows.append({"callback": name,
+                     "requests": len(latencies),
+                     "errors": stats.errors[name],
+                     "prevented": stats.prevented[name],
+                     "throughput_per_s": len(latencies) / elapsed,
+                     "p50_ms": 1000 * percentile(latencies, 50),
+                     "p95_ms": 1000 * percentile(latencies, 95),
+                     "p99_ms": 1000 * percentile(latencies, 99),
+                     "mean_response_bytes": stats.response_bytes[name] / len(latencies)})
+    for name, count in stats.errors.items():
+        if name not in stats.latencies:
+            rows.append({"callback": name, "requests": 0, "errors": count})
+
+    job_rows = [{"job": name, "completed": len(times),
+                 "p50_s": percentile(times, 50), "p95_s": percentile(times, 95),
+                 "max_s": max(times)}
+                for name, times in sorted(jobs.items()) if times]
+
+    total = sum(len(latencies) for latencies in stats.latencies.values())
+    return {"elapsed_s": elapsed, "requests": total,
+            "throughput_per_s": total / elapsed,
+            "callbacks": rows, "jobs": job_rows}
+
+
+def print_report(result):
+    print(f"\n{result['requests']} requests in {result['elapsed_s']:.1f}s "
+          f"({result['throughput_per_s']:.1f}/s)\n")
+    print(f"{'callback':<20}{'requests':>9}{'errors':>8}{'204':>6}{'req/s':>8}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'KiB/resp':>10}")
+    for row in result['callbacks']:
+        if not row['requests']:
+            print(f"{row['callback']:<20}{0:>9}{row['errors']:>8}")
+            continue
+        print(f"{row['callback']:<20}{row['requests']:>9}{row['errors']:>8}"
+              f"{row['prevented']:>6}{row['throughput_per_s']:>8.1f}"
+              f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}"
+              f"{row['mean_response_bytes'] / 1024:>10.1f}")
+    if result['jobs']:
+        print(f"\n{'job':<20}{'completed':>10}{'p50 s':>8}{'p95 s':>8}{'max s':>8}")
+        for row in result['jobs']:
+            print(f"{row['job']:<20}{row['completed']:>10}{row['p50_s']:>8.2f}"
+                  f"{row['p95_s']:>8.2f}{row['max_s']:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8050")
+    parser.add_argument("--dataset", required=True,
+                        help="dataset path as typed into the viewer (on the server)")
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--scrub-rate", type=float, default=10,
+                        help="slider moves per second per session")
+    parser.add_argument("--colormap-every", type=int, default=50,
+                        help="change the colormap every N slider moves (0: never)")
+    parser.add_argument("--render-3d-every", type=float, default=20,
+                        help="seconds between 3D renders per session (0: never)")
+    parser.add_argument("--download-every", type=float, default=0,
+                        help="seconds between downloads per session (0: never)")
+    parser.add_argument("--downloads", nargs="*", default=list(DOWNLOAD_BUTTONS),
+                        choices=list(DOWNLOAD_BUTTONS),
+                        help="download buttons clicked in turn (default: all)")
+    parser.add_argument("--poll-interval", type=float, default=0.5,
+                        help="job polling interval (JOB_POLL_MS in app.py)")
+    parser.add_argument("--output", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    stats = Stats()
+    jobs = defaultdict(list)
+    stop = threading.Event()
+    threads = [threading.Thread(target=run_session, args=(args, stats, jobs, stop, seed),
+                                daemon=True)
+               for seed in range(args.sessions)]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    try:
+        time.sleep(args.duration)
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    result = report(stats, jobs, elapsed)
+    print_report(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+'''
+Benchmarks of the viewer's hot paths on synthetic volumes.
+
+Every case is timed over --repeat runs and run once more under tracemalloc
+for its peak Python/numpy allocation. Results are written as JSON and can
+be compared against a stored baseline:
+
+    python benchmarks/run_benchmarks.py --sizes 64 256 --output current.json
+    python benchmarks/run_benchmarks.py --baseline baseline.json
+
+With --baseline, cases slower (or using more memory) than --threshold times
+the baseline are listed and the exit status is 1.
+'''
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+# run from anywhere: the viewer modules live in the parent directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import miscellaneous_functions as misc
+import dash_graphing_functions as dash_graph
+from volume_stats import VolumeStats
+from projections import PROJECTIONS, VolumeProjections
+
+
+DEFAULT_SIZES = [64, 128, 256]
+DEFAULT_DTYPES = ['uint8', 'uint16', 'float32']
+
+# Above these edge lengths the summary cases take minutes and are skipped
+# unless --all-cases: slices_along_axis builds one Heatmap trace per slice,
+# generate_summary exports three 3D renderings through Kaleido, and the
+# montages of generate_2D_summary grow with the slice count (about 25 s at
+# 512^3)
+MAX_SUMMARY_SIZE = 256
+MAX_MONTAGE_SIZE = 512
+
+
+def synthetic_volume(size, dtype, seed=0):
+    '''
+    Smooth blobs plus noise, scaled to the range of the dtype, so that
+    histograms, windows and compression behave like real data
+    '''
+    rng = np.random.default_rng(seed)
+    axis = np.linspace(-1, 1, size, dtype=np.float32)
+    x, y, z = axis[:, None, None], axis[None, :, None], axis[None, None, :]
+    volume = np.empty((size, size, size), dtype=np.float32)
+
+    # built plane by plane to keep float32 temporaries small
+    for i in range(size):
+        plane = (np.sin(4 * x[i]) * np.cos(3 * y) * np.sin(5 * z + 1) + 1) / 2
+        volume[i] = plane + rng.normal(0, 0.05, plane.shape)
+    np.clip(volume, 0, 1, out=volume)
+
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        volume *= np.iinfo(dtype).max
+        return volume.astype(dtype)
+    return volume.astype(dtype, copy=False)
+
+
+class Dataset:
+    '''
+    A synthetic volume with the files the load benchmarks read
+    '''
+
+    def __init__(self, size, dtype, workdir):
+        self.size = size
+        self.dtype = dtype
+        self.array = synthetic_volume(size, dtype)
+        self.stats = VolumeStats.from_array(self.array)
+        self.dir = Path(workdir) / f"{dtype}_{size}"
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._npy = None
+        self._tifs = None
+
+    @property
+    def npy(self):
+        if self._npy is None:
+            self._npy = str(self.dir / "volume.npy")
+            misc.save_array_as_npy(self.array, self._npy)
+        return self._npy
+
+    @property
+    def tifs(self):
+        if self._tifs is None:
+            self._tifs = self.dir / "tifs"
+            self._tifs.mkdir(exist_ok=True)
+            for i, plane in enumerate(self.array):
+                Image.fromarray(plane).save(self._tifs / f"plane_{i:05d}.tif")
+        return str(self._tifs)
+
+
+CASES = {}
+
+
+def case(name, max_size=None):
+    '''
+    Register a benchmark. The function receives a Dataset and returns the
+    callable that is timed (so that setup is not measured).
+    '''
+    def register(setup):
+        CASES[name] = (setup, max_size)
+        return setup
+    return register
+
+
+@case('stack_to_array')
+def bench_stack_to_array(dataset):
+    path = dataset.tifs
+    return lambda: misc.stack_to_array(path)
+
+
+@case('numpy_binary_to_array')
+def bench_numpy_binary_to_array(dataset):
+    path = dataset.npy
+    return lambda: misc.numpy_binary_to_array(path)
+
+
+@case('numpy_binary_to_array_mmap')
+def bench_numpy_binary_to_array_mmap(dataset):
+    path = dataset.npy
+    return lambda: misc.numpy_binary_to_array(path, mmap_mode='r')
+
+
+def slice_case(axis):
+    # a slider move through the update_slices callback request (coalescer,
+    # slice cache, prefetch), for a slice that is not cached yet; app is
+    # imported lazily because it builds the Dash app
+    def setup(dataset):
+        import app
+        handle = app.volume_registry.register(dataset.array)
+        app.volume_registry.get_derived(handle["dataset_id"], 'stats',
+                                        lambda volume: dataset.stats)
+        client = app.app.server.test_client()
+        outputs = [{"id": f"{a}-slice", "property": "figure"} for a in 'xyz']
+        session_id = f"benchmark-{axis}"
+
+        # positions further apart than the prefetch radius, so that the
+        # requested slice was never prefetched by the previous run
+        stride = 2 * app.PREFETCH_RADIUS + 1
+        positions = itertools.cycle(range(0, dataset.size, stride) or [0])
+
+        def run():
+            app.slice_cache.clear()
+            index = next(positions)
+            values = {a: index if a == axis else 0 for a in 'xyz'}
+            inputs = [{"id": "intermediate-value", "property": "data", "value": handle}]
+            inputs += [{"id": f"{a}_slider", "property": "value", "value": values[a]}
+                       for a in 'xyz']
+            inputs += [{"id": "colormap", "property": "value", "value": "rainbow"},
+                       {"id": "max_percent", "property": "value", "value": 98},
+                       {"id": "min_percent", "property": "value", "value": 2}]
+            response = client.post('/_dash-update-component', json={
+                "output": "..x-slice.figure...y-slice.figure...z-slice.figure..",
+                "outputs": outputs,
+                "inputs": inputs,
+                "state": [{"id": "session-id", "property": "data", "value": session_id}],
+                "changedPropIds": [f"{axis}_slider.value"]})
+            if response.status_code != 200:
+                raise RuntimeError(f"update_slices answered {response.status_code}")
+            return response.data
+        return run
+    return setup
+
+
+for _axis in 'xyz':
+    case(f'slice_{_axis}')(slice_case(_axis))
+
+
+@case('volume_stats')
+def bench_volume_stats(dataset):
+    return lambda: VolumeStats.from_array(dataset.array)
+
+
+@case('intensity_window')
+def bench_intensity_window(dataset):
+    # the lookup done by every slice request, on precomputed statistics
+    return lambda: dataset.stats.window(2, 98)
+
+
+@case('render_plotly_volume_view')
+def bench_render_plotly_volume_view(dataset):
+    return lambda: dash_graph.render_plotly_volume_view(dataset.array,
+                                                        stats=dataset.stats)
+
+
+def projection_case(method):
+    # all three axes, as built once per volume by app.lookup_projections
+    def setup(dataset):
+        return lambda: VolumeProjections.build(dataset.array, method)
+    return setup
+
+
+for _method in PROJECTIONS:
+    case(f'projection_{_method}')(projection_case(_method))
+
+
+@case('slices_along_axis', max_size=MAX_SUMMARY_SIZE)
+def bench_slices_along_axis(dataset):
+    return lambda: dash_graph.slices_along_axis(dataset.array, 'z',
+                                                stats=dataset.stats)
+
+
+@case('generate_2D_summary', max_size=MAX_MONTAGE_SIZE)
+def bench_generate_2D_summary(dataset):
+    return lambda: dash_graph.generate_2D_summary(dataset.array,
+                                                  stats=dataset.stats)
+
+
+@case('generate_summary', max_size=MAX_SUMMARY_SIZE)
+def bench_generate_summary(dataset):
+    return lambda: dash_graph.generate_summary(dataset.array,
+                                               stats=dataset.stats)
+
+
+def measure(run, repeat):
+    '''
+    Returns:
+        dict of timings (seconds) and peak traced allocation (bytes)
+    '''
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = run()
+        times.append(time.perf_counter() - start)
+        del result
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+
+    return {"seconds": statistics.median(times),
+            "seconds_min": min(times),
+            "peak_bytes": peak,
+            "repeat": repeat}
+
+
+def run_benchmarks(sizes, dtypes, names, repeat, all_cases=False, workdir=None):
+    '''
+    Returns:
+        list of result records
+    '''
+    results = []
+    workdir = workdir or tempfile.mkdtemp(prefix='volume-benchmarks-')
+    try:
+        for size in sizes:
+            for dtype in dtypes:
+                dataset = Dataset(size, dtype, workdir)
+                for name in names:
+                    setup, max_size = CASES[name]
+                    record = {"case": name, "size": size, "dtype": dtype}
+                    if max_size and size > max_size and not all_cases:
+                        record["skipped"] = f"size above {max_size}"
+                    else:
+                        try:
+                            record.update(measure(setup(dataset), repeat))
+                        except Exception as err:
+                            record["error"] = f"{type(err).__name__}: {err}"
+                    results.append(record)
+                    print(format_record(record), flush=True)
+                del dataset
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+
+def format_record(record):
+    label = f"{record['case']:<28} {record['dtype']:>8} {record['size']:>5}^3"
+    if "skipped" in record:
+        return f"{label}  skipped ({record['skipped']})"
+    if "error" in record:
+        return f"{label}  error: {record['error']}"
+    return (f"{label}  {record['seconds'] * 1000:10.1f} ms"
+            f"  {record['peak_bytes'] / 1024**2:9.1f} MiB peak")
+
+
+def result_key(record):
+    return (record["case"], record["size"], record["dtype"])
+
+
+def compare(results, baseline, threshold):
+    '''
+    Cases whose time or peak memory exceeds threshold times the baseline
+    Returns:
+        list of messages
+    '''
+    previous = {result_key(record): record for record in baseline["results"]}
+    regressions = []
+    for record in results:
+        before = previous.get(result_key(record))
+        if before is None or "seconds" not in record or "seconds" not in before:
+            continue
+        for metric in ("seconds", "peak_bytes"):
+            if before[metric] and record[metric] > threshold * before[metric]:
+                regressions.append(
+                    f"{format_record(record)}: {metric} {record[metric]:.4g} "
+                    f"vs baseline {before[metric]:.4g} "
+                    f"({record[metric] / before[metric]:.2f}x)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="volume edge lengths (e.g. 64 256 1024)")
+    parser.add_argument("--dtypes", nargs="+", default=DEFAULT_DTYPES)
+    parser.add_argument("--cases", nargs="+", default=list(CASES),
+                        choices=list(CASES), metavar="CASE",
+                        help="cases to run: " + ", ".join(CASES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--all-cases", action="store_true",
+                        help="also run the summary cases above their size limit")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="ratio to the baseline reported as a regression")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.dtypes, args.cases, args.repeat,
+                             all_cases=args.all_cases)
+
+    report = {"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "python": platform.python_version(),
+                       "numpy": np.__version__,
+                       "platform": platform.platform(),
+                       "cpu_count": os.cpu_count()},
+              "results": results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for message in regressions:
+            print("REGRESSION", message)
+        if regressions:
+            sys.exit(1)
+        print("no regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import threading
+import uuid
+from collections import OrderedDict
+import numpy as np
+
+
+# Number of dataset sources remembered for reloading evicted volumes
+MAX_SOURCES = 4096
+
+
+def resident_bytes(array):
+    '''
+    Memory an array holds on the heap. Memory-mapped arrays are backed by
+    the page cache, and chunked volumes bound their own chunk cache, so
+    they do not count against the budget.
+    '''
+    if not isinstance(array, np.ndarray):
+        return 0
+    if isinstance(array, np.memmap) or isinstance(array.base, np.memmap):
+        return 0
+    return array.nbytes
+
+
+class LRUCache:
+    '''
+    Thread-safe least-recently-used cache with a memory budget in bytes
+    Args:
+        max_bytes(int): total size of the cached values before eviction
+    '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()  # key -> (value, nbytes)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return self._items[key][0]
+
+    def put(self, key, value, nbytes):
+        '''
+        Insert (or replace) a value and evict the least recently used items
+        until the budget is met. The newest item is always kept, even when it
+        alone exceeds the budget.
+        '''
+        with self._lock:
+            if key in self._items:
+                self.current_bytes -= self._items.pop(key)[1]
+            self._items[key] = (value, nbytes)
+            self.current_bytes += nbytes
+
+            while self.current_bytes > self.max_bytes and len(self._items) > 1:
+                _, (_, evicted_bytes) = self._items.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            value, nbytes = self._items.pop(key)
+            self.current_bytes -= nbytes
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+
+class _VolumeEntry:
+    '''
+    A registered volume and the data derived from it (statistics, ...)
+    '''
+
+    def __init__(self, volume):
+        self.volume = volume
+        self.derived = {}
+        self.lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        derived_bytes = sum(getattr(value, 'nbytes', 0)
+                            for value in self.derived.values())
+        return resident_bytes(self.volume) + derived_bytes
+
+
+class VolumeRegistry:
+    '''
+    Process-local registry of loaded volumes. Dash stores only hold the small
+    handle returned by register(); callbacks look the array up by its
+    dataset ID instead of decoding the whole volume from JSON.
+    Args:
+        max_bytes(int): memory budget for all registered volumes
+    '''
+
+    def __init__(self, max_bytes):
+        self._cache = LRUCache(max_bytes)
+        # dataset ID -> source path, kept after the volume is evicted
+        self._sources = LRUCache(MAX_SOURCES)
+
+    def register(self, volume, dataset_id=None, source=None):
+        '''
+        Args:
+            volume(numpy 3D array):
+            dataset_id(str): stable ID for the volume; a random one if None
+            source(str): path the volume was loaded from (for reloading)
+        Returns:
+            handle(dict): dataset_id, shape, dtype and source of the volume
+        '''
+        if dataset_id is None:
+            dataset_id = uuid.uuid4().hex
+
+        entry = self._cache.get(dataset_id)
+        if entry is None or entry.volume is not volume:
+            entry = _VolumeEntry(volume)
+        self._cache.put(dataset_id, entry, entry.nbytes)
+        if source is not None:
+            self._sources.put(dataset_id, source, 1)
+
+        return {"dataset_id": dataset_id,
+                "shape": list(volume.shape),
+                "dtype": str(volume.dtype),
+                "source": source}
+
+    def get(self, dataset_id):
+        '''
+        Returns:
+            the registered array (not a copy), or None if it was evicted
+        '''
+        entry = self._cache.get(dataset_id)
+        return None if entry is None else entry.volume
+
+    def source(self, dataset_id):
+        '''
+        Returns:
+            the path a volume was registered with, also after it was
+            evicted, or None if unknown
+        '''
+        return self._sources.get(dataset_id)
+
+    def get_derived(self, dataset_id, name, build):
+        '''
+        Data derived from a registered volume, built on first use and kept
+        for as long as the volume stays registered
+        Args:
+            dataset_id(str):
+            name(str): key of the derived data (e.g. 'stats')
+            build(callable): build(volume) -> derived data
+        Returns:
+            derived data, or None if the volume is not registered
+        '''
+        entry = self._cache.get(dataset_id)
+        if entry is None:
+            return None
+
+        with entry.lock:
+            if name not in entry.derived:
+                entry.derived[name] = build(entry.volume)
+                # re-insert so that the budget accounts for the new data
+                if dataset_id in self._cache:
+                    self._cache.put(dataset_id, entry, entry.nbytes)
+            return entry.derived[name]
+
+    def __contains__(self, dataset_id):
+        return dataset_id in self._cache
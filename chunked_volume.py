@@ -0,0 +1,233 @@
+import itertools
+import json
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+from caching import LRUCache
+
+
+FORMAT_NAME = "chunked-volume"
+FORMAT_VERSION = 1
+METADATA_FILE = "volume.json"
+
+# Cubic chunks make a plane along any axis cost the same number of chunk
+# reads
+DEFAULT_CHUNKS = (64, 64, 64)
+
+# Memory budget for decoded chunks kept by each reader (bytes)
+CHUNK_CACHE_BYTES = 256 * 1024**2
+
+
+def is_chunked_volume(path):
+    '''
+    True if path is a directory written by write_chunked_volume
+    '''
+    return (Path(path) / METADATA_FILE).is_file()
+
+
+def _chunk_name(chunk_index):
+    return ".".join(str(i) for i in chunk_index)
+
+
+def write_chunked_volume(n_array, outdir, chunks=DEFAULT_CHUNKS, level=3,
+                         max_workers=None):
+    '''
+    Save a 3D array as a directory of zlib-compressed chunks plus a
+    volume.json describing them. The array is read one slab of chunks at a
+    time, so memory-mapped or chunked sources of any size can be converted.
+    Chunks that are entirely zero are not stored.
+    Args:
+        n_array(numpy 3D array):
+        outdir(str): path/to/output/directory
+        chunks(tuple): chunk shape
+        level(int): zlib compression level, 1 to 9
+        max_workers(int): threads compressing chunks
+    Returns:
+        None
+    '''
+    if len(n_array.shape) != 3 or len(chunks) != 3:
+        raise ValueError("Chunked volumes must be 3D")
+
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+
+    # the metadata is written last, so a half-written directory is not
+    # mistaken for a complete volume
+    metadata_path = outdir / METADATA_FILE
+    if metadata_path.exists():
+        metadata_path.unlink()
+    for old in outdir.iterdir():
+        if old.name.count('.') == 2 and old.name.replace('.', '').isdigit():
+            old.unlink()
+
+    shape = tuple(int(n) for n in n_array.shape)
+    dtype = np.dtype(n_array.dtype)
+    grid = [range(-(-n // c)) for n, c in zip(shape, chunks)]
+
+    def write_chunk(slab, i, j, k):
+        block = slab[:, j*chunks[1]:(j+1)*chunks[1], k*chunks[2]:(k+1)*chunks[2]]
+        if not block.any():
+            return
+        data = zlib.compress(np.ascontiguousarray(block).tobytes(), level)
+        with open(outdir / _chunk_name((i, j, k)), 'wb') as f:
+            f.write(data)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for i in grid[0]:
+            slab = np.asarray(n_array[i*chunks[0]:(i+1)*chunks[0]])
+            list(executor.map(lambda jk: write_chunk(slab, i, *jk),
+                              itertools.product(grid[1], grid[2])))
+
+    metadata = {"format": FORMAT_NAME,
+                "version": FORMAT_VERSION,
+                "shape": list(shape),
+                "dtype": dtype.str,
+                "chunks": list(chunks),
+                "compression": "zlib"}
+    with open(metadata_path, 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+
+def _axis_selection(key, size):
+    '''
+    Normalize one index of a volume key
+    Returns:
+        (selected indices as a numpy array, True if the axis is dropped)
+    '''
+    if isinstance(key, slice):
+        return np.arange(*key.indices(size)), False
+
+    index = int(key)
+    if index < 0:
+        index += size
+    if not 0 <= index < size:
+        raise IndexError(f"index {key} is out of bounds for axis with size {size}")
+    return np.array([index]), True
+
+
+def _chunk_runs(selection, chunk_size):
+    '''
+    Split selected indices into runs that fall into the same chunk
+    Yields:
+        (chunk number, slice of the output, indices within the chunk)
+    '''
+    if len(selection) == 0:
+        return
+    chunk_ids = selection // chunk_size
+    boundaries = np.flatnonzero(np.diff(chunk_ids)) + 1
+    starts = np.concatenate(([0], boundaries))
+    stops = np.concatenate((boundaries, [len(selection)]))
+    for start, stop in zip(starts, stops):
+        chunk_id = int(chunk_ids[start])
+        local = selection[start:stop] - chunk_id * chunk_size
+        if len(local) == 1 or np.all(np.diff(local) == 1):
+            local = slice(int(local[0]), int(local[-1]) + 1)
+        yield chunk_id, slice(int(start), int(stop)), local
+
+
+class ChunkedVolume:
+    '''
+    Read-only 3D volume stored by write_chunked_volume. Indexing with ints
+    and slices (vol[i], vol[:, j, :], vol[a:b, ::2, c]) decompresses only
+    the chunks intersecting the selection and returns a numpy array.
+    Decoded chunks are kept in an LRU cache, so neighbouring planes reuse
+    them.
+    Args:
+        path(str): path/to/chunked/volume/directory
+        cache_bytes(int): memory budget for decoded chunks
+        max_workers(int): threads decompressing chunks
+    '''
+
+    def __init__(self, path, cache_bytes=CHUNK_CACHE_BYTES, max_workers=4):
+        self.path = Path(path)
+        with open(self.path / METADATA_FILE) as f:
+            metadata = json.load(f)
+
+        if metadata.get("format") != FORMAT_NAME \
+                or metadata.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} "
+                             f"{FORMAT_NAME} directory")
+
+        self.shape = tuple(metadata["shape"])
+        self.dtype = np.dtype(metadata["dtype"])
+        self.chunks = tuple(metadata["chunks"])
+        self._cache = LRUCache(cache_bytes)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='chunk')
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return (f"ChunkedVolume({str(self.path)!r}, shape={self.shape}, "
+                f"dtype={self.dtype}, chunks={self.chunks})")
+
+    def _chunk_shape(self, chunk_index):
+        return tuple(min(c, n - i * c)
+                     for i, c, n in zip(chunk_index, self.chunks, self.shape))
+
+    def _read_chunk(self, chunk_index):
+        chunk = self._cache.get(chunk_index)
+        if chunk is not None:
+            return chunk
+
+        shape = self._chunk_shape(chunk_index)
+        try:
+            with open(self.path / _chunk_name(chunk_index), 'rb') as f:
+                data = zlib.decompress(f.read())
+            chunk = np.frombuffer(data, dtype=self.dtype).reshape(shape)
+        except FileNotFoundError:
+            # all-zero chunks are not stored
+            chunk = np.zeros(shape, dtype=self.dtype)
+            chunk.setflags(write=False)
+
+        self._cache.put(chunk_index, chunk, chunk.nbytes)
+        return chunk
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            at = key.index(Ellipsis)
+            key = key[:at] + (slice(None),) * (self.ndim - len(key) + 1) + key[at+1:]
+        if len(key) > self.ndim:
+            raise IndexError("too many indices for a 3D volume")
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        selections, dropped = zip(*(_axis_selection(k, n)
+                                    for k, n in zip(key, self.shape)))
+        out = np.empty(tuple(len(s) for s in selections), dtype=self.dtype)
+
+        runs = [list(_chunk_runs(s, c)) for s, c in zip(selections, self.chunks)]
+        pieces = list(itertools.product(*runs))
+
+        def copy_piece(piece):
+            chunk = self._read_chunk(tuple(chunk_id for chunk_id, _, _ in piece))
+            block = chunk
+            for axis, (_, _, local) in enumerate(piece):
+                block = block[(slice(None),) * axis + (local,)]
+            out[tuple(target for _, target, _ in piece)] = block
+
+        if len(pieces) > 1:
+            list(self._executor.map(copy_piece, pieces))
+        elif pieces:
+            copy_piece(pieces[0])
+
+        return out[tuple(0 if drop else slice(None) for drop in dropped)]
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[...]
+        return array if dtype is None else array.astype(dtype, copy=False)
@@ -0,0 +1,72 @@
+import itertools
+import threading
+import time
+
+
+class RequestCoalescer:
+    '''
+    Keeps track of the latest request per key (e.g. session and slider axis)
+    so that requests overtaken by a newer one can be dropped before, or
+    after, doing their work. Every submit() must be paired with a finish();
+    a key is forgotten when its last request finishes.
+    Args:
+        settle_seconds(float): how long a request waits for a newer one
+                               when others with the same key are in flight
+    '''
+
+    def __init__(self, settle_seconds=0.03):
+        self.settle_seconds = settle_seconds
+        self.dropped = 0
+        self._latest = {}  # key -> ticket of the newest request
+        self._in_flight = {}  # key -> number of unfinished requests
+        self._tickets = itertools.count()
+        self._lock = threading.Lock()
+
+    def submit(self, key):
+        '''
+        Register a new request for key; it supersedes all earlier ones
+        Returns:
+            ticket(int)
+        '''
+        with self._lock:
+            ticket = next(self._tickets)
+            self._latest[key] = ticket
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+            return ticket
+
+    def is_current(self, key, ticket):
+        with self._lock:
+            current = self._latest.get(key) == ticket
+            if not current:
+                self.dropped += 1
+            return current
+
+    def settle(self, key, ticket):
+        '''
+        Wait settle_seconds for a newer request with the same key, if other
+        requests with that key are in flight (a drag); a lone request
+        starts right away
+        Returns:
+            True if this request is still the newest one
+        '''
+        with self._lock:
+            contended = self._in_flight.get(key, 0) > 1
+        if self.settle_seconds and contended:
+            time.sleep(self.settle_seconds)
+        return self.is_current(key, ticket)
+
+    def finish(self, key):
+        '''
+        Mark one request for key as finished (rendered or dropped)
+        '''
+        with self._lock:
+            remaining = self._in_flight.get(key, 0) - 1
+            if remaining > 0:
+                self._in_flight[key] = remaining
+            else:
+                self._in_flight.pop(key, None)
+                self._latest.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._in_flight)
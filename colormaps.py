@@ -0,0 +1,157 @@
+import functools
+import numpy as np
+import plotly.colors
+from plotly.exceptions import PlotlyError
+
+try:
+    from matplotlib import colormaps as mpl_colormaps
+except ImportError:
+    mpl_colormaps = None
+
+
+# colormaps offered by the viewer
+COLORMAPS = ['rainbow', 'viridis', 'gray']
+
+# lookup table sizes: 256 entries are enough for 8-bit output; 4096 keep
+# distinct colors for fine windows of 12/16-bit data
+LUT_SIZE = 256
+FINE_LUT_SIZE = 4096
+
+
+def _from_matplotlib(colormap):
+    positions = np.linspace(0, 1, 256)
+    return positions, mpl_colormaps[colormap](positions)[:, :3]
+
+
+def _control_points(colormap, prefer='plotly'):
+    '''
+    Positions and RGB colors (0 to 1) defining a named colormap. Names
+    defined by both libraries ('jet', 'rainbow', ...) differ in color:
+    prefer picks the library that wins, the other is the fallback.
+    Args:
+        colormap(str):
+        prefer(str): 'plotly' (the viewer) or 'matplotlib' (the standalone
+                     module, whose images were drawn by matplotlib)
+    '''
+    if prefer == 'matplotlib' and mpl_colormaps is not None \
+            and colormap in mpl_colormaps:
+        return _from_matplotlib(colormap)
+
+    try:
+        scale = plotly.colors.get_colorscale(colormap)
+    except PlotlyError:
+        if mpl_colormaps is None or colormap not in mpl_colormaps:
+            raise ValueError(f"Unknown colormap: {colormap}")
+        return _from_matplotlib(colormap)
+
+    positions = np.array([pos for pos, _ in scale], dtype=float)
+    colors = plotly.colors.validate_colors([color for _, color in scale], 'tuple')
+    return positions, np.array(colors, dtype=float)
+
+
+@functools.lru_cache(maxsize=32)
+def lookup_table(colormap, size=LUT_SIZE, alpha=False, prefer='plotly'):
+    '''
+    Lookup table of a named colormap, interpolated linearly in RGB like
+    plotly.js colors a heatmap
+    Args:
+        colormap(str): Plotly colorscale or matplotlib colormap name
+        size(int): number of entries
+        alpha(boolean): add an opaque alpha channel
+        prefer(str): library whose definition wins for names both have
+                     (see _control_points)
+    Returns:
+        read-only (size, 3) or (size, 4) uint8 numpy array
+    '''
+    positions, colors = _control_points(colormap, prefer)
+    steps = np.linspace(0, 1, size)
+
+    lut = np.full((size, 4 if alpha else 3), 255, dtype=np.uint8)
+    for channel in range(3):
+        lut[:, channel] = np.rint(255 * np.interp(steps, positions,
+                                                  colors[:, channel]))
+    lut.flags.writeable = False
+    return lut
+
+
+def plotly_colorscale(colormap, stops=16):
+    '''
+    The colormap as a Plotly colorscale, sampled from its lookup table so
+    that Plotly figures match the images colored here
+    Returns:
+        list of [position, 'rgb(r, g, b)']
+    '''
+    lut = lookup_table(colormap)
+    rows = np.linspace(0, len(lut) - 1, stops).round().astype(int)
+    return [[i / (stops - 1), 'rgb({}, {}, {})'.format(*lut[row, :3])]
+            for i, row in enumerate(rows)]
+
+
+def _lut_indices(values, vmin, vmax, levels):
+    # window float values to lookup table indices in place
+    span = float(vmax) - float(vmin)
+    if span > 0:
+        values -= np.float32(vmin)
+        values *= np.float32(levels / span)
+    else:
+        values[:] = 0
+    np.clip(values, 0, levels, out=values)
+    np.nan_to_num(values, copy=False)
+    np.rint(values, out=values)
+    return values.astype(np.intp)
+
+
+@functools.lru_cache(maxsize=16)
+def _value_lookup_table(colormap, size, alpha, prefer, dtype, vmin, vmax):
+    '''
+    Table from every value of an 8/16-bit integer dtype straight to its
+    color, so that integer data is colored with a single lookup
+    '''
+    info = np.iinfo(dtype)
+    values = np.arange(info.min, info.max + 1, dtype=np.float32)
+    table = lookup_table(colormap, size, alpha, prefer)[_lut_indices(values, vmin, vmax,
+                                                                     size - 1)]
+    table.flags.writeable = False
+    return table
+
+
+def apply_colormap(data, vmin, vmax, colormap='rainbow', size=LUT_SIZE,
+                   alpha=False, out=None, prefer='plotly', reuse_window=True):
+    '''
+    Color an array: values are windowed to [vmin, vmax] and mapped through
+    the colormap's lookup table in one vectorized pass
+    Args:
+        data(numpy array): any integer or float dtype, any shape
+        vmin(float): value mapped to the first color
+        vmax(float): value mapped to the last color
+        colormap(str):
+        size(int): lookup table size (LUT_SIZE or FINE_LUT_SIZE)
+        alpha(boolean): RGBA instead of RGB output
+        out(numpy array): optional uint8 array of shape data.shape + (3,)
+                          (or (4,) with alpha) to write the colors into
+        prefer(str): see lookup_table
+        reuse_window(boolean): False when vmin/vmax change with every call
+                               (e.g. each slice scaled to its own range);
+                               skips the per-window value table, which would
+                               only churn its cache
+    Returns:
+        uint8 numpy array of shape data.shape + (3,) or (4,)
+    '''
+    data = np.asarray(data)
+    channels = 4 if alpha else 3
+
+    if reuse_window and data.dtype.kind in 'ui' and data.dtype.itemsize <= 2 \
+            and (data.dtype.itemsize == 1 or data.size >= 1 << 16):
+        table = _value_lookup_table(colormap, size, alpha, prefer, data.dtype.str,
+                                    float(vmin), float(vmax))
+        indices = data
+        if data.dtype.kind == 'i':
+            indices = data.astype(np.int32) - np.iinfo(data.dtype).min
+    else:
+        table = lookup_table(colormap, size, alpha, prefer)
+        indices = _lut_indices(data.astype(np.float32), vmin, vmax, size - 1)
+
+    if out is None:
+        out = np.empty(data.shape + (channels,), dtype=np.uint8)
+    np.take(table, indices, axis=0, out=out, mode='clip')
+    return out
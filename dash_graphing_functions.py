@@ -1,12 +1,73 @@
+import functools
 import io
 import math
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 #from pathlib import Path
 import plotly.graph_objects as go 
-#import plotly.express as px
+import plotly.express as px
 from plotly.subplots import make_subplots
 import numpy as np
 from PIL import Image
 #import matplotlib.pyplot as plt
+from volume_stats import VolumeStats
+import miscellaneous_functions as misc
+import kaleido_pool
+import montage
+import colormaps
+import streaming_export
+import metrics
+from projections import VolumeProjections
+
+
+def renderable(array):
+    '''
+    Return the array in a dtype Plotly can serialize, converting only the
+    dtypes that need it (bool, float16). Everything else, including uint8
+    and uint16, is passed through without a copy. Volumes that are not numpy
+    arrays (chunked volumes) are read in full.
+    '''
+    array = np.asarray(array)
+    if array.dtype == np.bool_:
+        return array.astype(np.uint8)
+    if array.dtype == np.float16:
+        return array.astype(np.float32)
+    return array
+
+
+def intensity_window(vol_array, min_pct, max_pct, stats=None):
+    '''
+    Intensity values at the min and max percentiles of a volume
+    Args:
+        vol_array(numpy 3D array):
+        min_pct(float):
+        max_pct(float):
+        stats(VolumeStats): precomputed statistics of vol_array; if None,
+                            percentiles are computed from the full array
+    Returns:
+        (minval, maxval)
+    '''
+    if stats is not None:
+        return stats.window(min_pct, max_pct)
+
+    return np.percentile(vol_array, min_pct), np.percentile(vol_array, max_pct)
+
+
+def render_slice_view(plane, zmin, zmax, colormap='rainbow'):
+    '''
+    Generates the plotly figure of a single 2D slice
+    Args:
+        plane(numpy 2D array):
+        zmin(float): intensity mapped to the lowest color
+        zmax(float): intensity mapped to the highest color
+        colormap(str): see colormaps.lookup_table
+    Returns:
+        plotly.graph_object.Figure
+    '''
+    # the colorscale comes from the same lookup table as the exported
+    # montages; Plotly still colors the raw values for hover and colorbar
+    return px.imshow(plane, zmin=zmin, zmax=zmax,
+                     color_continuous_scale=colormaps.plotly_colorscale(colormap))
 
 
 def render_plotly_volume_view(vol_array, 
@@ -18,7 +79,7 @@ def render_plotly_volume_view(vol_array,
                             min_pct = 2,
                             max_pct = 98,
                             opacity=0.3, opacityscale=0.3,
-                            surface_count=12):
+                            surface_count=12, stats=None, voxel_step=1):
     '''
     Generates 3D plotly figure
     Args:
@@ -31,22 +92,26 @@ def render_plotly_volume_view(vol_array,
         opacity(float):
         opacityscale(float):
         surface_count(int): should not be too large or too small
+        stats(VolumeStats): precomputed statistics of vol_array (optional)
+        voxel_step(int): spacing of vol_array's voxels in original voxels,
+                         i.e. the downsampling factor of a pyramid level
     Returns:
         plotly figure(plotly.graph_object.Figure) or its byte_array version
     '''
 
     # calculate min and max values
-    minval = np.percentile(vol_array, min_pct)
-    maxval = np.percentile(vol_array, max_pct)
+    with metrics.stage('render_plotly_volume_view', 'percentile'):
+        minval, maxval = intensity_window(vol_array, min_pct, max_pct, stats)
 
+    build_start = time.perf_counter()
 
-    X, Y, Z = np.mgrid[0:vol_array.shape[0], 0:vol_array.shape[1], 0:vol_array.shape[2]]
+    X, Y, Z = misc.volume_coordinates(tuple(vol_array.shape), voxel_step)
     vol = go.Volume(
           name=name,
-          x = X.flatten(),
-          y = Y.flatten(),
-          z = Z.flatten(),
-          value = vol_array.flatten(),
+          x = X,
+          y = Y,
+          z = Z,
+          value = renderable(vol_array).ravel(),
           opacity = opacity,
           opacityscale = opacityscale,
           surface_count = surface_count,
@@ -60,7 +125,7 @@ def render_plotly_volume_view(vol_array,
     # Tick customization
     vals = []
     texts = []
-    for i in range (0,max(vol_array.shape),8):
+    for i in range (0,max(vol_array.shape)*voxel_step,8*voxel_step):
         vals.append(i)
         texts.append(str(i*voxel_size_um))
 
@@ -91,9 +156,12 @@ def render_plotly_volume_view(vol_array,
                         margin=dict(l=20, r=20, t=100, b=100, pad=4),
                         paper_bgcolor="LightBlue",
                         height=600)
+    metrics.observe_stage('render_plotly_volume_view', 'figure_build',
+                          time.perf_counter() - build_start)
 
     if output_bytes:
-        plotly_bytes = fig_3d.to_image(format="png")
+        with metrics.stage('render_plotly_volume_view', 'kaleido'):
+            plotly_bytes = kaleido_pool.to_image(fig_3d, format="png")
         return io.BytesIO(plotly_bytes)
 
     else:
@@ -103,12 +171,13 @@ def render_plotly_volume_view(vol_array,
 
 def slices_along_axis(vol_array, axis, output_bytes=False,
                       min_pct=2, max_pct=98, colormap="rainbow", imgs_in_row=6, 
-                      title=None):
+                      title=None, stats=None):
     '''
     Args:
         vol_array(numpy 3D array):
         output_bytes(boolean): True for byte array, 
                                False for plotly.graph_object.Figure
+        stats(VolumeStats): precomputed statistics of vol_array (optional)
 
     Returns:
         byte_array
@@ -130,29 +199,29 @@ def slices_along_axis(vol_array, axis, output_bytes=False,
     # divisor is just for a friendly size. May need to be smaller
     
     # calculate min and max values
-    vmin = np.percentile(vol_array, min_pct)
-    vmax = np.percentile(vol_array, max_pct)
+    vmin, vmax = intensity_window(vol_array, min_pct, max_pct, stats)
 
+    colorscale = colormaps.plotly_colorscale(colormap)
     fig = make_subplots(rows=row_count, cols=imgs_in_row)
     
     for j in range(row_count):
         for i in range(imgs_in_row):
             if j*imgs_in_row+i < img_count:
                 if axis == 'x':
-                    fig.add_trace(go.Heatmap(z=vol_array[j*imgs_in_row+i, :, :],
+                    fig.add_trace(go.Heatmap(z=renderable(vol_array[j*imgs_in_row+i, :, :]),
                                   zmin=vmin, zmax=vmax,
-                                  colorscale=colormap,
+                                  colorscale=colorscale,
                                   ), row=j+1, col=i+1)
 
                 elif axis == 'y':
-                    fig.add_trace(go.Heatmap(z=vol_array[:, j*imgs_in_row+i, :],
+                    fig.add_trace(go.Heatmap(z=renderable(vol_array[:, j*imgs_in_row+i, :]),
                                   zmin=vmin, zmax=vmax,
-                                  colorscale=colormap,
+                                  colorscale=colorscale,
                                   ), row=j+1, col=i+1)
                 else:
-                    fig.add_trace(go.Heatmap(z=vol_array[:, :, j*imgs_in_row+i],
+                    fig.add_trace(go.Heatmap(z=renderable(vol_array[:, :, j*imgs_in_row+i]),
                                   zmin=vmin, zmax=vmax,
-                                  colorscale=colormap,
+                                  colorscale=colorscale,
                                   ), row=j+1, col=i+1)
                 fig.update_xaxes(visible=False, showticklabels=False, row=j+1, col=i+1)
                 fig.update_yaxes(visible=False, showticklabels=False, row=j+1, col=i+1)
@@ -160,7 +229,7 @@ def slices_along_axis(vol_array, axis, output_bytes=False,
     fig.update_layout(showlegend=False)
     
     if output_bytes:  
-        slices_bytes = fig.to_image(format="png", width=figsize[0], height=figsize[1])
+        slices_bytes = kaleido_pool.to_image(fig, format="png", width=figsize[0], height=figsize[1])
         return io.BytesIO(slices_bytes)
 
     else:
@@ -168,57 +237,156 @@ def slices_along_axis(vol_array, axis, output_bytes=False,
 
 
 
+def projection_panel(projection, min_pct=2, max_pct=98, colormap="rainbow"):
+    '''
+    Summary panel with the projections along x, y and z next to each other,
+    each with its own colorbar and window (percentiles of the projection)
+    Args:
+        projection(VolumeProjections):
+    Returns:
+        streaming_export.ImagePanel
+    '''
+    images = []
+    for axis in ['x', 'y', 'z']:
+        plane = projection[axis]
+        vmin, vmax = np.percentile(plane, [min_pct, max_pct])
+        # a one-tile montage, laid out and oriented like the slice montages
+        tile = montage.slice_montage(plane[None], 'x', vmin, vmax,
+                                     colormap=colormap, imgs_in_row=1,
+                                     max_pixels=montage.MAX_MONTAGE_PIXELS // 3)
+        images.append(Image.fromarray(tile))
+
+    return streaming_export.ImagePanel.side_by_side(images,
+                                                    background=montage.BACKGROUND)
+
+
+
+def render_in_parallel(tasks, progress=None):
+    '''
+    Run image rendering calls concurrently; Kaleido exports are spread over
+    the renderers of kaleido_pool
+    Args:
+        tasks(list): (function, kwargs) pairs
+        progress(callable): called as progress(tasks_done, task_count)
+    Returns:
+        list of results, in the order of tasks
+    '''
+    with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+        futures = [executor.submit(fn, **kwargs) for fn, kwargs in tasks]
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                future.result()
+                if progress:
+                    progress(done, len(tasks))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    return [future.result() for future in futures]
+
+
+
+def write_summary(vol_array, outfile, min_pct=92, max_pct=98,
+                  colormap_2D="rainbow", imgs_in_row=4, include_3D=True,
+                  title_3D=None, voxel_size_um=1.0, colorscale_3D="rainbow",
+                  opacity=0.3, opacityscale=0.3, surface_count=12,
+                  projections=(), stats=None, progress=None):
+    '''
+    Write a summary PNG: the slice montages along x, y and z, the intensity
+    projections, if any, and the 3D renderings along x, y and z. The image
+    is streamed to outfile one row of slices at a time, so memory use does
+    not grow with the size of the volume.
+    Args:
+        vol_array(numpy 3D array):
+        outfile(str or file object): /path/to/output/file.png
+        include_3D(boolean): False for the slice montages only
+        projections(list): projection methods ('max', 'mean', 'min') or
+                           precomputed VolumeProjections, one panel each
+        stats(VolumeStats): precomputed statistics of vol_array (optional)
+        progress(callable): called as progress(steps_done, step_count)
+    '''
+
+    # compute percentiles once for all images
+    with metrics.stage('write_summary', 'percentile'):
+        if stats is None:
+            stats = VolumeStats.from_array(vol_array)
+        vmin, vmax = intensity_window(vol_array, min_pct, max_pct, stats)
+
+    panels = [montage.SliceMontage(vol_array, axis, vmin, vmax,
+                                   colormap=colormap_2D,
+                                   imgs_in_row=imgs_in_row)
+              for axis in ['x', 'y', 'z']]
+
+    for projection in projections:
+        with metrics.stage('write_summary', 'projection'):
+            if isinstance(projection, str):
+                projection = VolumeProjections.build(vol_array, projection)
+            panels.append(projection_panel(projection, min_pct, max_pct,
+                                           colormap_2D))
+
+    tasks = []
+    if include_3D:
+        for axis in ['x','y','z']:
+            tasks.append((render_plotly_volume_view, dict(vol_array=vol_array, 
+                                                          output_bytes=True, 
+                                                          axis=axis,
+                                                          name=title_3D,
+                                                          voxel_size_um=voxel_size_um,
+                                                          colorscale=colorscale_3D,
+                                                          min_pct=min_pct,
+                                                          max_pct=max_pct,
+                                                          opacity=opacity,
+                                                          opacityscale=opacityscale,
+                                                          surface_count=surface_count,
+                                                          stats=stats)))
+
+    # progress steps: each 3D export, then each panel written to outfile
+    step_count = len(tasks) + len(panels) + len(tasks)
+
+    def report(done, total, first=0):
+        if progress:
+            progress(first + done, step_count)
+
+    if tasks:
+        # the 3D images are exported concurrently (see kaleido_pool); their
+        # size has to be known before the PNG header is written
+        with metrics.stage('write_summary', 'render_3d'):
+            for img in render_in_parallel(tasks, report):
+                panels.append(streaming_export.ImagePanel(img))
+
+    # reads and colors the slices and encodes the PNG
+    with metrics.stage('write_summary', 'montage_png'):
+        streaming_export.write_stacked(outfile, panels, background=montage.BACKGROUND,
+                                       progress=functools.partial(report, first=len(tasks)))
+
+
+
 def generate_2D_summary(vol_array, outfile=None, min_pct=2, max_pct=98, 
-                        colormap="rainbow", imgs_in_row=4, title=None):
+                        colormap="rainbow", imgs_in_row=4, title=None,
+                        projections=(), stats=None, progress=None):
 
     '''
+    Slice montages along x, y and z (see write_summary, which writes large
+    summaries to a file without holding them in memory)
+    Args:
+        projections(list): projection methods ('max', 'mean', 'min') to add
+        stats(VolumeStats): precomputed statistics of vol_array (optional)
+        progress(callable): called as progress(images_done, image_count)
     Return:
         img_byte_arr: byte array
     '''
 
-    images = []                                                             
-    for axis in ['x', 'y', 'z']:
-        slice_img = slices_along_axis(vol_array, axis, 
-                                      output_bytes=True,
-                                      min_pct=min_pct, 
-                                      max_pct=max_pct,
-                                      colormap=colormap,
-                                      imgs_in_row=imgs_in_row,
-                                      title=title)
-
-        images.append(slice_img)   
-        
-    # Convert the byte arrays to viewable images and concatenate               
-    graphs = [Image.open(img) for img in images]                               
-
-    img_size = [0,0] # (width, height)  
-
-    for graph in graphs:                                                  
-        if graph.width > img_size[0]:                                          
-            img_size[0] = graph.width                                          
-        img_size[1] = img_size[1] + graph.height                               
-                                                                           
-    summary_img = Image.new('RGB', (img_size[0], img_size[1]))                 
-    current_pos = [0,0]                                                        
-                                                                        
-    ##  Stitch all graphs together                                          
-    # Matplotlib images                                                     
-    for graph in graphs:                                               
-        summary_img.paste(graph,  current_pos)                              
-        # bring the current position down by the pasted image's height      
-        current_pos = (0, current_pos[1] + graph.height) 
+    img_byte_arr = io.BytesIO()
+    write_summary(vol_array, img_byte_arr, min_pct=min_pct, max_pct=max_pct,
+                  colormap_2D=colormap, imgs_in_row=imgs_in_row,
+                  include_3D=False, projections=projections, stats=stats,
+                  progress=progress)
 
     if outfile:
-        summary_img.save(outfile)
-
-    for img in images:
-        img.close()
-
+        with open(outfile, 'wb') as f:
+            f.write(img_byte_arr.getbuffer())
 
-    # Convert to byte array
-    img_byte_arr = io.BytesIO()
-    summary_img.save(img_byte_arr, format='PNG')
-    
     return img_byte_arr
 
 
@@ -226,13 +394,21 @@ def generate_2D_summary(vol_array, outfile=None, min_pct=2, max_pct=98,
 def generate_summary(vol_array, outfile=None, min_pct=92, max_pct=98, 
                      colormap_2D="rainbow", imgs_in_row=4, title_2D=None,
                      title_3D=None, voxel_size_um=1.0, colorscale_3D="rainbow",
-                     opacity=0.3, opacityscale=0.3, surface_count=12):
+                     opacity=0.3, opacityscale=0.3, surface_count=12,
+                     include_3D=True, projections=(), stats=None, progress=None):
     '''
     Generate a summary of 3D volume rendering. If outfile name is given
     (e.g., output.png), it saves as such; otherwise, returns a byte array.
+    Use write_summary to write large summaries to a file without holding
+    them in memory.
     Args:
         vol_array(numpy 3D array):
         outfile(str): /path/to/output/file.png
+        include_3D(boolean): False to skip the (slow) 3D renderings, e.g.
+                             when the projections give enough of an overview
+        projections(list): projection methods ('max', 'mean', 'min') to add
+        stats(VolumeStats): precomputed statistics of vol_array (optional)
+        progress(callable): called as progress(images_done, image_count)
     Returns:
         if outfile: None (data saved)
         else: byte array
@@ -241,69 +417,19 @@ def generate_summary(vol_array, outfile=None, min_pct=92, max_pct=98,
     #QUESTION: Should min_pct and max_pct for 2D and 3D be separated? 
     #QUESTION: Should this be combined with the method above?
 
-    images = []                                              
-
-    # 2D images
-    for axis in ['x', 'y', 'z']:
-        slice_img = slices_along_axis(vol_array, axis, 
-                                      output_bytes=True,
-                                      min_pct=min_pct, 
-                                      max_pct=max_pct,
-                                      colormap=colormap_2D,
-                                      imgs_in_row=imgs_in_row,
-                                      title=title_2D)
-
-        images.append(slice_img)   
-
-
-    # Render 3D Images
-    for axis in ['x','y','z']:
-        plotly_img = render_plotly_volume_view(vol_array, 
-                                               output_bytes=True, 
-                                               axis=axis,
-                                               name=title_3D,
-                                               voxel_size_um=voxel_size_um,
-                                               colorscale=colorscale_3D,
-                                               min_pct=min_pct,
-                                               max_pct=max_pct,
-                                               opacity=opacity,
-                                               opacityscale=opacityscale,
-                                               surface_count=surface_count)
-        images.append(plotly_img)
-
-
-    # Convert the byte arrays to viewable images and concatenate
-    graphs = [Image.open(img) for img in images]
-
-    # At this point, there should be 6 images
-
-    img_size = [0,0] # (width, height)
-
-    for graph in graphs:
-        if graph.width > img_size[0]:
-            img_size[0] = graph.width
-        img_size[1] = img_size[1] + graph.height
-
-    summary_img = Image.new('RGB', (img_size[0], img_size[1]))
-    current_pos=[0,0]
-
-    ##  Stitch all graphs together
-    for graph in graphs:
-        summary_img.paste(graph,  current_pos)
-        # bring the current position down by the pasted image's height
-        current_pos = (0, current_pos[1] + graph.height)
+    img_byte_arr = io.BytesIO()
+    write_summary(vol_array, img_byte_arr, min_pct=min_pct, max_pct=max_pct,
+                  colormap_2D=colormap_2D, imgs_in_row=imgs_in_row,
+                  title_3D=title_3D, voxel_size_um=voxel_size_um,
+                  colorscale_3D=colorscale_3D, opacity=opacity,
+                  opacityscale=opacityscale, surface_count=surface_count,
+                  include_3D=include_3D, projections=projections,
+                  stats=stats, progress=progress)
 
-    
     if outfile:
-        summary_img.save(outfile)
+        with open(outfile, 'wb') as f:
+            f.write(img_byte_arr.getbuffer())
 
-    for img in images:
-        img.close()
-
-    # Convert to byte array
-    img_byte_arr = io.BytesIO()
-    summary_img.save(img_byte_arr, format='PNG')
-    
     return img_byte_arr
 
 
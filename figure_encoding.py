@@ -0,0 +1,102 @@
+import base64
+import numpy as np
+
+
+# numpy dtype -> plotly.js typed array code
+TYPED_ARRAY_CODES = {
+    'int8': 'i1', 'uint8': 'u1',
+    'int16': 'i2', 'uint16': 'u2',
+    'int32': 'i4', 'uint32': 'u4',
+    'float32': 'f4', 'float64': 'f8',
+}
+
+
+def _typed_array_compatible(array):
+    # plotly.js has no 64-bit integer, float16 or bool typed arrays
+    if array.dtype == np.bool_:
+        return array.astype(np.uint8)
+    if array.dtype == np.float16:
+        return array.astype(np.float32)
+    if array.dtype.kind in 'iu' and array.dtype.itemsize == 8:
+        if array.size and array.min() >= np.iinfo(np.int32).min \
+                and array.max() <= np.iinfo(np.int32).max:
+            return array.astype(np.int32)
+        return array.astype(np.float64)
+    return array
+
+
+def encode_typed_array(array):
+    '''
+    Encode a numeric array as a plotly.js typed array spec
+    ({"dtype", "bdata", "shape"}) straight from its buffer
+    Args:
+        array(numpy array): numeric or bool array
+    Returns:
+        dict
+    '''
+    array = _typed_array_compatible(np.asarray(array))
+    # typed arrays are little-endian and C-ordered
+    array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+
+    spec = {"dtype": TYPED_ARRAY_CODES[array.dtype.name],
+            "bdata": base64.b64encode(array.data).decode('ascii')}
+    if array.ndim > 1:
+        spec["shape"] = ", ".join(str(n) for n in array.shape)
+
+    return spec
+
+
+def _encode_arrays(obj):
+    if isinstance(obj, np.ndarray) and obj.dtype.kind in 'biuf':
+        return encode_typed_array(obj)
+    if isinstance(obj, dict):
+        return {key: _encode_arrays(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_encode_arrays(value) for value in obj]
+    return obj
+
+
+def binary_figure(fig):
+    '''
+    Convert a figure to a dict in which every numeric array is a base64
+    typed array instead of a JSON list of numbers. Requires plotly.js 2.28
+    or newer on the client (Dash 2.15+); Kaleido 0.2.1 cannot read it.
+    Args:
+        fig(plotly.graph_objects.Figure):
+    Returns:
+        dict (usable anywhere Dash accepts a figure)
+    '''
+    return _encode_arrays(fig.to_dict())
+
+
+def compact_plane(plane, minval, maxval):
+    '''
+    Represent a 2D slice as uint8/uint16/float32 for the binary slice
+    transport, so that plane ~= offset + compact * scale. uint8 and uint16
+    planes are sent as they are and float planes as float32; other integer
+    planes spanning at most 65536 values are shifted losslessly; wider
+    integer planes are quantized to 16 bits over the volume's
+    [minval, maxval] range.
+    Args:
+        plane(numpy 2D array):
+        minval(float): minimum of the whole volume
+        maxval(float): maximum of the whole volume
+    Returns:
+        (compact numpy 2D array, offset, scale)
+    '''
+    if plane.dtype in (np.uint8, np.uint16):
+        return plane, 0.0, 1.0
+
+    if plane.dtype.kind == 'f':
+        # quantizing would make the clientside view differ from the server's
+        return plane.astype(np.float32, copy=False), 0.0, 1.0
+
+    if plane.dtype.kind in 'iub' and maxval - minval <= 65535:
+        scale = 1.0
+    else:
+        scale = (maxval - minval) / 65535 if maxval > minval else 1.0
+
+    compact = np.rint((plane.astype(np.float64) - minval) / scale)
+    compact = compact.clip(0, 65535).astype(np.uint16)
+
+    return compact, float(minval), float(scale)
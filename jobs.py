@@ -0,0 +1,162 @@
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobCancelled(Exception):
+    '''
+    Raised inside a job when it has been cancelled
+    '''
+
+
+class Job:
+    '''
+    A unit of long-running work (3D render, PNG export, ...)
+    Attributes:
+        id(str):
+        owner(str): session the job belongs to
+        target(str): what the result is for (e.g. the output component)
+        status(str): 'queued', 'running', 'done', 'failed' or 'cancelled'
+        progress(float): 0 to 1
+        result: return value of the job function once done
+        error(str): error message if the job failed
+        traceback(str): formatted traceback if the job failed
+    '''
+
+    def __init__(self, owner, target, description):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.target = target
+        self.description = description
+        self.status = 'queued'
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.traceback = None
+        self.submitted = time.time()
+        self.finished = None
+        self._cancel_requested = threading.Event()
+        self._future = None
+
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+    def report(self, done, total):
+        '''
+        Progress callback for the job function, compatible with the
+        progress(done, total) arguments used elsewhere. Raises JobCancelled
+        once the job has been cancelled, which stops the job at that point.
+        '''
+        self.progress = done / total if total else 1.0
+        if self._cancel_requested.is_set():
+            raise JobCancelled()
+
+
+class JobManager:
+    '''
+    Runs jobs on a bounded thread pool, so that long renders and exports
+    do not block the web server's request workers
+    Args:
+        max_workers(int): number of jobs that run at the same time
+        max_age(float): seconds after which finished, undelivered jobs are
+                        discarded
+    '''
+
+    def __init__(self, max_workers=2, max_age=3600):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers,
+                                        thread_name_prefix='job')
+        self._jobs = {}  # job id -> Job
+        self._lock = threading.Lock()
+        self.max_age = max_age
+
+    def submit(self, owner, target, description, fn, *args, **kwargs):
+        '''
+        Queue fn(*args, progress=job.report, **kwargs)
+        Args:
+            owner(str): session submitting the job
+            target(str): what the result is for
+            description(str): shown to the user while the job runs
+            fn(callable): job function; must accept a progress argument
+        Returns:
+            Job
+        '''
+        job = Job(owner, target, description)
+
+        def run():
+            if job._cancel_requested.is_set():
+                # cancelled after the pool picked the job up; cancel() could
+                # not stop the future, so the job is marked here
+                job.status = 'cancelled'
+                job.finished = time.time()
+                return
+            job.status = 'running'
+            try:
+                job.result = fn(*args, progress=job.report, **kwargs)
+                job.progress = 1.0
+                job.status = 'done'
+            except JobCancelled:
+                job.status = 'cancelled'
+            except Exception as err:
+                job.error = str(err)
+                job.traceback = traceback.format_exc()
+                print(f"Error: job {description!r} failed:\n{job.traceback}")
+                job.status = 'failed'
+            finally:
+                job.finished = time.time()
+
+        with self._lock:
+            self._discard_expired()
+            self._jobs[job.id] = job
+            job._future = self._pool.submit(run)
+
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs_of(self, owner):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.owner == owner]
+
+    def cancel(self, job_id):
+        '''
+        Cancel a queued job, or stop a running one at its next progress report
+        '''
+        job = self.get(job_id)
+        if job is None or not job.active:
+            return
+        job._cancel_requested.set()
+        if job._future.cancel():
+            job.status = 'cancelled'
+            job.finished = time.time()
+
+    def poll(self, owner):
+        '''
+        Remove the finished jobs of an owner and list the ones still active,
+        in one pass under the lock, so that a job finishing meanwhile is
+        reported in one of the two lists
+        Returns:
+            (finished jobs oldest first, active jobs)
+        '''
+        finished, active = [], []
+        with self._lock:
+            for job in list(self._jobs.values()):
+                if job.owner != owner:
+                    continue
+                if job.active:
+                    active.append(job)
+                else:
+                    finished.append(job)
+                    del self._jobs[job.id]
+        return sorted(finished, key=lambda job: job.submitted), active
+
+    def _discard_expired(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and now - job.finished > self.max_age]
+        for job_id in expired:
+            del self._jobs[job_id]
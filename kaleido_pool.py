@@ -0,0 +1,167 @@
+import os
+import queue
+import threading
+import plotly
+import plotly.io as pio
+
+try:
+    import kaleido
+    from kaleido.scopes.plotly import PlotlyScope
+except ImportError:
+    PlotlyScope = None
+
+
+# Kaleido versions whose private process handling (PlotlyScope._proc,
+# _ensure_kaleido and _shutdown_kaleido) the pool relies on. With any other
+# version, figures are exported through plotly's own Kaleido scope.
+SUPPORTED_KALEIDO_VERSIONS = ('0.2.',)
+
+# Number of renderers of the default pool; app.py sets it from
+# KALEIDO_POOL_SIZE
+POOL_SIZE = 2
+
+
+def _pool_supported():
+    version = getattr(kaleido, '__version__', '')
+    if not version.startswith(SUPPORTED_KALEIDO_VERSIONS) or \
+            not all(hasattr(PlotlyScope, name)
+                    for name in ('_ensure_kaleido', '_shutdown_kaleido')):
+        print(f"Kaleido {version or '(unknown version)'} is not supported by "
+              "kaleido_pool; exporting through plotly.io.to_image instead")
+        return False
+    return True
+
+
+if PlotlyScope is not None and not _pool_supported():
+    PlotlyScope = None
+
+
+# plotly.js bundled with plotly.py, as used by plotly.io.to_image
+PLOTLYJS_PATH = os.path.join(os.path.dirname(os.path.abspath(plotly.__file__)),
+                             "package_data", "plotly.min.js")
+
+
+class KaleidoPool:
+    '''
+    A fixed number of warm Kaleido renderer processes. plotly.io.to_image
+    shares a single Kaleido process between all threads, so concurrent
+    exports queue up behind each other; this pool renders up to `size`
+    figures at the same time.
+    Args:
+        size(int): number of Kaleido processes
+    '''
+
+    def __init__(self, size=2):
+        # plotly imports its JSON engine lazily on first use; do that here
+        # rather than from several export threads at once
+        pio.to_json({"data": [], "layout": {}}, validate=False)
+
+        self.size = size
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put(PlotlyScope(plotlyjs=PLOTLYJS_PATH))
+
+    @staticmethod
+    def _healthy(scope):
+        # scope._proc is the Kaleido subprocess (None until first use)
+        return scope._proc is not None and scope._proc.poll() is None
+
+    def _restart(self, scope):
+        scope._shutdown_kaleido()
+        scope._ensure_kaleido()
+
+    def warm_up(self):
+        '''
+        Start all Kaleido processes now rather than on their first export
+        '''
+        self.health_check()
+
+    def health_check(self):
+        '''
+        Restart the idle renderers whose process has died (or never started)
+        Returns:
+            number of renderers checked
+        '''
+        checked = []
+        while True:
+            try:
+                scope = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                if not self._healthy(scope):
+                    self._restart(scope)
+            finally:
+                checked.append(scope)
+
+        for scope in checked:
+            self._idle.put(scope)
+        return len(checked)
+
+    def to_image(self, fig, format="png", width=None, height=None, scale=None):
+        '''
+        Same as fig.to_image, on the next free renderer of the pool
+        Args:
+            fig(plotly.graph_object.Figure or dict):
+        Returns:
+            image bytes
+        '''
+        if not isinstance(fig, dict):
+            fig = fig.to_dict()
+
+        scope = self._idle.get()
+        try:
+            if not self._healthy(scope):
+                self._restart(scope)
+            return scope.transform(fig, format=format, width=width,
+                                   height=height, scale=scale)
+        except Exception:
+            # start from a fresh process next time
+            scope._shutdown_kaleido()
+            raise
+        finally:
+            self._idle.put(scope)
+
+    def shutdown(self):
+        while True:
+            try:
+                self._idle.get_nowait()._shutdown_kaleido()
+            except queue.Empty:
+                break
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def default_pool(size=None):
+    '''
+    The process-wide pool used by dash_graphing_functions
+    Args:
+        size(int): pool size, POOL_SIZE by default; only used when the pool
+                   is first created
+    Returns:
+        KaleidoPool, or None if kaleido is not installed or its version is
+        not supported
+    '''
+    global _default_pool
+
+    if PlotlyScope is None:
+        return None
+
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = KaleidoPool(size or POOL_SIZE)
+        return _default_pool
+
+
+def to_image(fig, format="png", width=None, height=None):
+    '''
+    Export a figure through the default pool, falling back to
+    fig.to_image (and its error message) when kaleido is missing or not
+    supported by the pool
+    '''
+    pool = default_pool()
+    if pool is None:
+        return fig.to_image(format=format, width=width, height=height)
+    return pool.to_image(fig, format=format, width=width, height=height)
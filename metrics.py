@@ -0,0 +1,178 @@
+import bisect
+import contextlib
+import threading
+import time
+
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+BYTES_BUCKETS = tuple(1024 * 4**i for i in range(12))  # 1 KiB to 4 GiB
+
+
+class Histogram:
+    '''
+    Cumulative histogram in the Prometheus sense: a count per bucket upper
+    bound, plus the sum and count of all observations
+    '''
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        '''
+        Yields:
+            (le label, cumulative count)
+        '''
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            yield ('+Inf' if bound == float('inf') else repr(bound)), cumulative
+
+
+class MetricFamily:
+    '''
+    Histograms or counters of one metric, keyed by their label values
+    '''
+
+    def __init__(self, name, help_text, label_names, buckets=None):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = buckets
+        self.series = {}  # label values -> Histogram, or float for counters
+
+    @property
+    def kind(self):
+        return 'histogram' if self.buckets else 'counter'
+
+    def observe(self, labels, value):
+        if self.buckets:
+            if labels not in self.series:
+                self.series[labels] = Histogram(self.buckets)
+            self.series[labels].observe(value)
+        else:
+            self.series[labels] = self.series.get(labels, 0) + value
+
+    def _labels(self, values, extra=()):
+        pairs = list(zip(self.label_names, values)) + list(extra)
+        return ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}",
+                 f"# TYPE {self.name} {self.kind}"]
+        for values, series in sorted(self.series.items()):
+            if self.buckets:
+                for le, count in series.samples():
+                    lines.append(f"{self.name}_bucket{{{self._labels(values, [('le', le)])}}} {count}")
+                lines.append(f"{self.name}_sum{{{self._labels(values)}}} {series.sum!r}")
+                lines.append(f"{self.name}_count{{{self._labels(values)}}} {series.count}")
+            else:
+                lines.append(f"{self.name}{{{self._labels(values)}}} {series!r}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRegistry:
+    '''
+    Latency, payload size and memory metrics of the Dash callbacks, and the
+    duration of the stages of long operations (3D renders, exports),
+    rendered in the Prometheus text format
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.callback_seconds = MetricFamily(
+            "dash_callback_duration_seconds",
+            "Time spent in a Dash callback request", ["callback"], LATENCY_BUCKETS)
+        self.request_bytes = MetricFamily(
+            "dash_callback_request_bytes",
+            "Size of the callback request body (inputs and state)", ["callback"],
+            BYTES_BUCKETS)
+        self.response_bytes = MetricFamily(
+            "dash_callback_response_bytes",
+            "Size of the callback response body (outputs)", ["callback"],
+            BYTES_BUCKETS)
+        self.peak_alloc_bytes = MetricFamily(
+            "dash_callback_peak_alloc_bytes",
+            "Peak traced allocation during a callback request (approximate "
+            "when requests overlap)", ["callback"], BYTES_BUCKETS)
+        self.callback_errors = MetricFamily(
+            "dash_callback_errors_total",
+            "Callback requests answered with an error status", ["callback"])
+        self.stage_seconds = MetricFamily(
+            "volume_viewer_stage_duration_seconds",
+            "Time spent in a stage of a render or export", ["operation", "stage"],
+            LATENCY_BUCKETS)
+
+    @property
+    def families(self):
+        return [self.callback_seconds, self.request_bytes, self.response_bytes,
+                self.peak_alloc_bytes, self.callback_errors, self.stage_seconds]
+
+    def observe_callback(self, callback, seconds, request_bytes, response_bytes,
+                         peak_bytes=None, error=False):
+        labels = (callback,)
+        with self._lock:
+            self.callback_seconds.observe(labels, seconds)
+            self.request_bytes.observe(labels, request_bytes)
+            self.response_bytes.observe(labels, response_bytes)
+            if peak_bytes is not None:
+                self.peak_alloc_bytes.observe(labels, peak_bytes)
+            if error:
+                self.callback_errors.observe(labels, 1)
+
+    def observe_stage(self, operation, stage, seconds):
+        with self._lock:
+            self.stage_seconds.observe((operation, stage), seconds)
+
+    @contextlib.contextmanager
+    def stage(self, operation, stage):
+        '''
+        Time the enclosed block as one stage of an operation:
+            with registry.stage('render_plotly_volume_view', 'kaleido'):
+                ...
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(operation, stage, time.perf_counter() - start)
+
+    def render(self):
+        '''
+        Returns:
+            all metrics in the Prometheus text exposition format (str)
+        '''
+        with self._lock:
+            lines = []
+            for family in self.families:
+                if family.series:
+                    lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+# process-wide registry used by app.py and dash_graphing_functions
+registry = MetricsRegistry()
+
+
+def stage(operation, stage_name):
+    '''
+    Time a stage of an operation in the process-wide registry
+    '''
+    return registry.stage(operation, stage_name)
+
+
+def observe_stage(operation, stage_name, seconds):
+    registry.observe_stage(operation, stage_name, seconds)
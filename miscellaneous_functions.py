@@ -1,14 +1,25 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
 from pathlib import Path
 from PIL import Image
 import re
+import chunked_volume
+from caching import LRUCache
 
 
-def stack_to_array(stack_path):
+def stack_to_array(stack_path, dtype=None, max_workers=None,
+                   progress=None):
     '''
-    Convert subvol stack TIF to numpy
+    Convert subvol stack TIF to numpy. The output is allocated once from the
+    size of the first plane and planes are decoded into it in parallel.
     Args:
         stack_path(str): path/to/directory/containing/numbered/tif/files
+        dtype(numpy dtype): dtype of the returned array; None keeps the
+                            dtype of the tif files (e.g. uint8, uint16)
+        max_workers(int): number of reader threads (None for the
+                          ThreadPoolExecutor default)
+        progress(callable): called as progress(planes_done, plane_count)
     Returns:
         numpy 3D array
     '''
@@ -22,13 +33,28 @@ def stack_to_array(stack_path):
     else:
         files = list(dataset.glob('*.tif'))
         files.sort(key=lambda f: int(re.sub(r'[^0-9]*', "", str(f))))
-        vol_array = [] 
 
-        for f in files:
-          vol_array.append(np.array(Image.open(f), dtype=np.float32))
-        
-        # convert to numpy
-        vol_array = np.array(vol_array)
+        if not files:
+            print("Error: no tif files found in the volume directory.")
+            return np.zeros((1,1,1))
+
+        # only the header of the first plane is needed to size the output
+        with Image.open(files[0]) as first:
+            width, height = first.size
+            if dtype is None:
+                dtype = np.asarray(first).dtype
+        vol_array = np.empty((len(files), height, width), dtype=dtype)
+
+        def read_plane(index):
+            with Image.open(files[index]) as img:
+                vol_array[index] = np.asarray(img)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(read_plane, i) for i in range(len(files))]
+            for done, future in enumerate(as_completed(futures), start=1):
+                future.result()
+                if progress:
+                    progress(done, len(files))
         
         # sanity check
         print("numpy array shape: ", np.shape(vol_array))
@@ -53,13 +79,33 @@ def save_array_as_npy(n_array, outfile):
         np.save(f, n_array)
 
 
-def numpy_binary_to_array(npy_file):
+def save_array_as_chunked(n_array, outdir, chunks=chunked_volume.DEFAULT_CHUNKS,
+                          level=3):
+    '''
+    Save numpy array as a chunked, compressed volume directory, from which
+    planes along any axis can be read without loading the whole volume
+    (see chunked_volume.write_chunked_volume)
+    Args:
+        n_array(numpy 3D array)
+        outdir(str): path/to/output/directory
+        chunks(tuple): chunk shape
+        level(int): zlib compression level, 1 to 9
+    Returns:
+        None
+    '''
+    chunked_volume.write_chunked_volume(n_array, outdir, chunks=chunks,
+                                        level=level)
+
+
+def numpy_binary_to_array(npy_file, mmap_mode=None):
     '''
     Load .npy file
     Args:
         npy_file(str): path/to/npy/file
+        mmap_mode(str): None to read the whole file into memory, or a
+                        numpy.memmap mode ('r', 'c', ...) to map it lazily
     Returns:
-        numpy array
+        numpy array (numpy.memmap if mmap_mode is given)
     '''
 
     datafile = Path(npy_file)
@@ -68,6 +114,10 @@ def numpy_binary_to_array(npy_file):
         print("Error: numpy binary file not found.")
         return np.zeros((1,1,1))
 
+    elif mmap_mode:
+        # pages are only read from disk when a slice touches them
+        array = np.load(npy_file, mmap_mode=mmap_mode)
+
     else:
         with open(npy_file, 'rb') as f:
             array = np.load(f)
@@ -75,3 +125,113 @@ def numpy_binary_to_array(npy_file):
     return array
 
 
+def load_volume(data_path, mmap_mode=None):
+    '''
+    Load a volume from an .npy file, a chunked volume directory (see
+    save_array_as_chunked) or a directory of tif files
+    Args:
+        data_path(str): path/to/npy/file or path/to/directory
+        mmap_mode(str): memory-map .npy files with this mode (see
+                        numpy_binary_to_array); ignored for tif stacks
+    Returns:
+        numpy 3D array, or chunked_volume.ChunkedVolume, which reads
+        chunks on demand
+    '''
+    if Path(data_path).suffix == ".npy":
+        return numpy_binary_to_array(data_path, mmap_mode=mmap_mode)
+
+    elif chunked_volume.is_chunked_volume(data_path):
+        return chunked_volume.ChunkedVolume(data_path)
+
+    elif Path(data_path).is_dir():
+        return stack_to_array(data_path)
+
+    else:
+        print("Incorrect input")
+        return np.zeros((1,1,1))
+
+
+def dataset_id(data_path):
+    '''
+    Stable ID for a dataset path; changes when the file or directory is
+    modified so that stale cached volumes are not reused
+    Args:
+        data_path(str): path/to/npy/file or path/to/directory/of/tif/files
+    Returns:
+        str
+    '''
+    path = Path(data_path).resolve()
+    try:
+        if chunked_volume.is_chunked_volume(path):
+            # rewritten last by every save
+            stat = (path / chunked_volume.METADATA_FILE).stat()
+        else:
+            stat = path.stat()
+        signature = f"{path}:{stat.st_mtime_ns}:{stat.st_size}"
+    except OSError:
+        signature = str(path)
+
+    return hashlib.sha1(signature.encode()).hexdigest()
+
+
+def extract_slice(volume, axis, index):
+    '''
+    Copy a single plane out of a volume. For memory-mapped volumes only the
+    pages holding that plane are read.
+    Args:
+        volume(numpy 3D array, numpy.memmap or ChunkedVolume):
+        axis(str): 'x', 'y' or 'z'
+        index(int): slice number along the axis
+    Returns:
+        numpy 2D array (in memory, C-contiguous)
+    '''
+    if axis == 'x':
+        plane = volume[index, :, :]
+    elif axis == 'y':
+        plane = volume[:, index, :]
+    else:  # axis == 'z'
+        plane = volume[:, :, index]
+
+    return np.ascontiguousarray(plane)
+
+
+# Memory budget for cached voxel coordinates (bytes); larger coordinate
+# sets, e.g. of full-resolution exports, are rebuilt on every call
+COORDINATE_CACHE_BYTES = 128 * 1024**2
+
+_coordinate_cache = LRUCache(COORDINATE_CACHE_BYTES)
+
+
+def volume_coordinates(shape, step=1):
+    '''
+    Flattened x, y, z voxel coordinates of a volume, in the same (C) order
+    as volume.ravel(). Equivalent to flattening np.mgrid, but stored in the
+    smallest unsigned integer dtype that fits and cached per shape within
+    COORDINATE_CACHE_BYTES. The returned arrays are read-only because they
+    may be shared between calls.
+    Args:
+        shape(tuple): (size_x, size_y, size_z)
+        step(int): spacing between voxels (e.g. a downsampling factor)
+    Returns:
+        (x, y, z) numpy 1D arrays
+    '''
+    key = (tuple(shape), step)
+    cached = _coordinate_cache.get(key)
+    if cached is not None:
+        return cached
+
+    size_x, size_y, size_z = shape
+    dtype = np.min_scalar_type(max(0, max(shape) - 1) * step)
+
+    x = np.repeat(np.arange(0, size_x*step, step, dtype=dtype), size_y*size_z)
+    y = np.tile(np.repeat(np.arange(0, size_y*step, step, dtype=dtype), size_z), size_x)
+    z = np.tile(np.arange(0, size_z*step, step, dtype=dtype), size_x*size_y)
+
+    for coords in (x, y, z):
+        coords.setflags(write=False)
+
+    nbytes = x.nbytes + y.nbytes + z.nbytes
+    if nbytes <= _coordinate_cache.max_bytes:
+        _coordinate_cache.put(key, (x, y, z), nbytes)
+
+    return x, y, z
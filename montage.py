@@ -0,0 +1,169 @@
+import math
+import numpy as np
+from PIL import Image, ImageDraw
+import colormaps
+
+
+# Tiles are enlarged by an integer factor (like the *3 figure size of the old
+# Plotly export) as long as the montage stays below this many pixels
+MAX_MONTAGE_PIXELS = 48_000_000
+
+BACKGROUND = (255, 255, 255)
+
+
+def _plane(vol_array, axis, index):
+    if axis == 'x':
+        return vol_array[index, :, :]
+    elif axis == 'y':
+        return vol_array[:, index, :]
+    return vol_array[:, :, index]
+
+
+def _colorbar(height, width, lut):
+    # highest value at the top, as in a Plotly colorbar
+    rows = np.linspace(len(lut) - 1, 0, height).round().astype(np.intp)
+    return np.broadcast_to(lut[rows][:, None, :], (height, width, 3))
+
+
+class SliceMontage:
+    '''
+    Every slice of a volume along an axis, tiled into one RGB image. Slices
+    are laid out and oriented as in slices_along_axis (first slice top left,
+    row 0 of each slice at the bottom), with a colorbar on the right.
+    The image is produced one row of slices at a time (see bands), reading
+    one slice from vol_array at a time, so it can be streamed to a file
+    without holding the whole montage in memory.
+    Args:
+        vol_array(numpy 3D array):
+        axis(str): 'x', 'y' or 'z'
+        vmin(float): intensity mapped to the lowest color
+        vmax(float): intensity mapped to the highest color
+        colormap(str): see colormaps.lookup_table
+        imgs_in_row(int):
+        scale(int): enlargement factor of each slice (nearest neighbour)
+        gap(int): pixels between slices; default scales with the slice size
+        colorbar(boolean):
+        max_pixels(int): the scale is reduced, and slices subsampled if
+                         necessary, to keep the montage below this size
+    '''
+
+    def __init__(self, vol_array, axis, vmin, vmax, colormap='rainbow',
+                 imgs_in_row=6, scale=3, gap=None, colorbar=True,
+                 max_pixels=MAX_MONTAGE_PIXELS):
+        self.vol_array = vol_array
+        self.axis = axis
+        self.vmin = vmin
+        self.vmax = vmax
+        self.colormap = colormap
+        self.imgs_in_row = imgs_in_row
+        self.colorbar = colorbar
+
+        axis_n = 'xyz'.index(axis)
+        self.img_count = vol_array.shape[axis_n]
+        plane_shape = [n for i, n in enumerate(vol_array.shape) if i != axis_n]
+        self.row_count = math.ceil(self.img_count / imgs_in_row)
+
+        # choose the largest scale (or smallest subsampling step) that fits
+        base_pixels = self.img_count * plane_shape[0] * plane_shape[1]
+        self.step = 1
+        self.scale = max(1, min(scale, int(math.sqrt(max_pixels / max(base_pixels, 1)))))
+        if base_pixels > max_pixels:
+            self.step = math.ceil(math.sqrt(base_pixels / max_pixels))
+        self.tile_h = math.ceil(plane_shape[0] / self.step) * self.scale
+        self.tile_w = math.ceil(plane_shape[1] / self.step) * self.scale
+
+        if gap is None:
+            gap = max(2, min(self.tile_h, self.tile_w) // 10)
+        self.gap = gap
+        self.margin = 2 * gap
+        self.bar_w = max(12, self.tile_w // 8) if colorbar else 0
+        label_w = 70 if colorbar else 0
+
+        self.grid_w = imgs_in_row * self.tile_w + (imgs_in_row - 1) * gap
+        self.grid_h = self.row_count * self.tile_h + (self.row_count - 1) * gap
+        self.bar_left = self.margin + self.grid_w + self.margin
+        self.width = self.margin + self.grid_w + self.margin
+        if colorbar:
+            self.width += self.bar_w + label_w + self.margin
+        self.height = self.margin + self.grid_h + self.margin
+
+    def _blank(self, rows):
+        band = np.empty((rows, self.width, 3), dtype=np.uint8)
+        band[:] = BACKGROUND
+        return band
+
+    def _tile_row(self, row, lut):
+        height = self.tile_h + (self.gap if row < self.row_count - 1 else 0)
+        band = self._blank(height)
+        first = row * self.imgs_in_row
+        for n in range(first, min(first + self.imgs_in_row, self.img_count)):
+            plane = _plane(self.vol_array, self.axis, n)[::self.step, ::self.step][::-1]
+
+            left = self.margin + (n - first) * (self.tile_w + self.gap)
+            tile = band[:self.tile_h, left:left + self.tile_w]
+            if self.scale == 1:
+                colormaps.apply_colormap(plane, self.vmin, self.vmax,
+                                         self.colormap, out=tile)
+            else:
+                rgb = colormaps.apply_colormap(plane, self.vmin, self.vmax,
+                                               self.colormap)
+                # nearest-neighbour enlargement without an intermediate copy
+                tile.reshape(rgb.shape[0], self.scale, rgb.shape[1], self.scale, 3)[:] = \
+                    rgb[:, None, :, None, :]
+
+        if self.colorbar:
+            top = row * (self.tile_h + self.gap)
+            bar = _colorbar(self.grid_h, self.bar_w, lut)[top:top + height]
+            band[:, self.bar_left:self.bar_left + self.bar_w] = bar
+            band = self._label(band, row)
+        return band
+
+    def _label(self, band, row):
+        labels = []
+        if row == 0:
+            labels.append((0, self.vmax))
+        if row == self.row_count - 1:
+            labels.append((max(0, len(band) - 12), self.vmin))
+        if not labels:
+            return band
+
+        image = Image.fromarray(band)
+        draw = ImageDraw.Draw(image)
+        for y, value in labels:
+            draw.text((self.bar_left + self.bar_w + 4, y), '{:.4g}'.format(value),
+                      fill=(0, 0, 0))
+        return np.asarray(image)
+
+    def bands(self):
+        '''
+        Yields the image from top to bottom as (rows, width, 3) uint8 arrays,
+        one row of slices each
+        '''
+        lut = colormaps.lookup_table(self.colormap)
+        yield self._blank(self.margin)
+        for row in range(self.row_count):
+            yield self._tile_row(row, lut)
+        yield self._blank(self.margin)
+
+    def to_array(self):
+        '''
+        Returns:
+            (height, width, 3) uint8 numpy array
+        '''
+        montage = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        top = 0
+        for band in self.bands():
+            montage[top:top + len(band)] = band
+            top += len(band)
+        return montage
+
+
+def slice_montage(vol_array, axis, vmin, vmax, **kwargs):
+    '''
+    SliceMontage as a single array
+    Args:
+        kwargs: passed on to SliceMontage
+    Returns:
+        (height, width, 3) uint8 numpy array
+    '''
+    return SliceMontage(vol_array, axis, vmin, vmax, **kwargs).to_array()
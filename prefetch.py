@@ -0,0 +1,63 @@
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+
+class Prefetcher:
+    '''
+    Runs work the user is likely to ask for next in a background thread
+    pool. Work is grouped by scope (e.g. a volume and slice axis); each new
+    request for a scope cancels the queued work that is no longer wanted.
+    Args:
+        max_workers(int): number of background threads
+    '''
+
+    def __init__(self, max_workers=2):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers,
+                                        thread_name_prefix='prefetch')
+        self._pending = {}  # scope -> {key: future}
+        self._lock = threading.Lock()
+
+    def prefetch(self, scope, tasks):
+        '''
+        Args:
+            scope(hashable): group of related work
+            tasks(dict): key -> callable, in order of priority. Replaces the
+                         previous tasks of the scope; queued tasks whose key
+                         is not in it are cancelled.
+        '''
+        with self._lock:
+            pending = self._pending.get(scope, {})
+
+            for key, future in pending.items():
+                if key not in tasks:
+                    future.cancel()
+
+            kept = {key: future for key, future in pending.items()
+                    if key in tasks and not future.cancelled()}
+            for key, task in tasks.items():
+                if key not in kept:
+                    kept[key] = self._pool.submit(task)
+
+            self._pending[scope] = kept
+
+    def cancel(self, scope):
+        with self._lock:
+            for future in self._pending.pop(scope, {}).values():
+                future.cancel()
+
+    def wait(self, scope, key):
+        '''
+        Block until the prefetch of key finishes, if one is queued or running
+        Returns:
+            True if a prefetch of key completed, False otherwise
+        '''
+        with self._lock:
+            future = self._pending.get(scope, {}).get(key)
+
+        if future is None or future.cancelled():
+            return False
+        try:
+            future.result()
+        except (CancelledError, Exception):
+            return False
+        return True
@@ -0,0 +1,217 @@
+import collections
+import contextlib
+import functools
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import tracemalloc
+
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+
+# Frames kept per allocation traceback; the cost of tracemalloc grows with
+# it, so only the allocating line and its caller are kept
+TRACE_FRAMES = 2
+
+
+class SamplingProfiler:
+    '''
+    Samples the stack of one thread at a fixed interval from a background
+    thread. Unlike cProfile it does not hook every call of the profiled
+    code, so its cost is small enough for a production server (allocation
+    tracing, see capture, is not).
+    Args:
+        thread_id(int): threading.get_ident() of the thread to sample
+        interval(float): seconds between samples
+    '''
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()  # folded stack -> samples
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='sampling-profiler')
+
+    @staticmethod
+    def _frame_name(frame):
+        code = frame.f_code
+        filename = os.path.basename(code.co_filename)
+        # ';' separates frames in the folded format
+        return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(';', ':')
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                names.append(self._frame_name(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self):
+        '''
+        Returns:
+            the samples in the folded stack format ("root;...;leaf count"
+            per line) read by flamegraph.pl, speedscope and inferno
+        '''
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_started = False  # True if tracing was started here, not elsewhere
+
+
+def _start_tracing():
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        _tracing_users += 1
+        if _tracing_users == 1 and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+            _tracing_started = True
+        tracemalloc.reset_peak()
+
+
+def _stop_tracing():
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
+
+
+class CaptureStore:
+    '''
+    Directory of profile captures, keeping only the most recent ones.
+    Each capture is a subdirectory with:
+        stacks.folded    sampled stacks (flamegraph input)
+        allocations.txt  largest allocations still alive at the end, with
+                         tracebacks, and the peak traced memory
+        capture.json     label, duration, sample count, ...
+    Args:
+        directory(str):
+        keep(int): number of captures kept
+    '''
+
+    def __init__(self, directory, keep=20):
+        self.directory = directory
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def captures(self):
+        '''
+        Returns:
+            capture directory names, oldest first
+        '''
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory)
+                      if os.path.isdir(os.path.join(self.directory, name)))
+
+    def save(self, label, profiler, snapshot, info):
+        safe_label = re.sub(r'[^A-Za-z0-9_.-]+', '_', label)[:80]
+        name = time.strftime('%Y%m%d-%H%M%S') + f"-{time.time_ns() % 10**9:09d}-{safe_label}"
+        path = os.path.join(self.directory, name)
+
+        with self._lock:
+            os.makedirs(path)
+            with open(os.path.join(path, 'stacks.folded'), 'w') as f:
+                f.write(profiler.folded())
+            if snapshot is not None:
+                with open(os.path.join(path, 'allocations.txt'), 'w') as f:
+                    f.write(format_allocations(snapshot, info.get('peak_alloc_bytes')))
+            with open(os.path.join(path, 'capture.json'), 'w') as f:
+                json.dump(info, f, indent=2)
+
+            for old in self.captures()[:-self.keep or None]:
+                shutil.rmtree(os.path.join(self.directory, old), ignore_errors=True)
+
+        return path
+
+
+def format_allocations(snapshot, peak_bytes=None, limit=25):
+    '''
+    The largest allocation sites of a tracemalloc snapshot, with tracebacks
+    '''
+    lines = ["# tracemalloc traces every thread, so allocations of concurrent",
+             "# requests are included",
+             f"peak traced memory during the capture: {peak_bytes} bytes", ""]
+    for stat in snapshot.statistics('traceback')[:limit]:
+        lines.append(f"{stat.size} bytes in {stat.count} blocks")
+        lines.extend("    " + line for line in stat.traceback.format())
+        lines.append("")
+    return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def capture(store, label, interval=SAMPLE_INTERVAL, trace_memory=False):
+    '''
+    Profile the enclosed block on the current thread and save the capture
+    to store:
+        with profiling.capture(store, 'update_slices'):
+            ...
+    trace_memory also records allocations with tracemalloc. It traces every
+    thread of the process, so it slows down all concurrent requests, not
+    only the profiled one.
+    '''
+    profiler = SamplingProfiler(threading.get_ident(), interval)
+    if trace_memory:
+        _start_tracing()
+    started = time.time()
+    start = time.perf_counter()
+    profiler.start()
+    error = None
+    try:
+        yield
+    except BaseException as err:
+        error = repr(err)
+        raise
+    finally:
+        profiler.stop()
+        seconds = time.perf_counter() - start
+
+        snapshot, peak = None, None
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            _stop_tracing()
+
+        info = {"label": label,
+                "started": time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)),
+                "seconds": seconds,
+                "samples": sum(profiler.stacks.values()),
+                "interval": interval,
+                "peak_alloc_bytes": peak,
+                "error": error}
+        try:
+            store.save(label, profiler, snapshot, info)
+        except OSError as err:
+            print("Error: could not save profile capture:", err)
+
+
+def profiled(store, fn, label=None, **capture_kwargs):
+    '''
+    Wrap fn so that every call is captured (e.g. a dash_graphing_functions
+    function)
+    '''
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with capture(store, label or fn.__name__, **capture_kwargs):
+            return fn(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,125 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+
+
+# Reductions offered for projection views
+PROJECTIONS = ['max', 'mean', 'min']
+
+# Size of the slabs reduced by each worker thread (bytes)
+SLAB_BYTES = 16 * 1024**2
+
+
+def _slab_planes(vol_array, slab_bytes):
+    plane_bytes = int(np.prod(vol_array.shape[1:])) * vol_array.dtype.itemsize
+    step = max(1, slab_bytes // max(1, plane_bytes))
+
+    # chunked volumes decode whole chunks: keep slabs on chunk boundaries
+    chunks = getattr(vol_array, 'chunks', None)
+    if isinstance(chunks, tuple):
+        step = max(1, step // chunks[0]) * chunks[0]
+    return step
+
+
+def _sum_dtype(dtype, length):
+    # 8- and 16-bit integers are summed in 32 bits, about twice as fast as
+    # float64, as long as length values cannot overflow
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.integer) and dtype.itemsize <= 2:
+        info = np.iinfo(dtype)
+        wide = np.dtype(np.int32 if info.min < 0 else np.uint32)
+        if max(abs(info.min), info.max) * length <= np.iinfo(wide).max:
+            return wide
+    return np.dtype(np.float64)
+
+
+def _reduce_slab(vol_array, start, stop, method):
+    '''
+    Returns:
+        (projection of the slab along x, rows of the y and z projections)
+    '''
+    # read here, on the worker thread, so that slabs are read concurrently
+    slab = np.asarray(vol_array[start:stop])
+    if method == 'max':
+        return slab.max(axis=0), slab.max(axis=1), slab.max(axis=2)
+    if method == 'min':
+        return slab.min(axis=0), slab.min(axis=1), slab.min(axis=2)
+    # mean: sums here, divided by the axis length once all slabs are done
+    sum_dtype = _sum_dtype(slab.dtype, max(slab.shape))
+    return tuple(slab.sum(axis=axis, dtype=sum_dtype) for axis in range(3))
+
+
+class VolumeProjections:
+    '''
+    Maximum, mean or minimum intensity projections of a volume along x, y
+    and z. Each projection is oriented like the slices along the same axis
+    (misc.extract_slice), so it can be shown with the same figure code.
+    Attributes:
+        method(str): 'max', 'mean' or 'min'
+        planes(dict): axis -> numpy 2D array; max and min keep the dtype of
+                      the volume, mean is float32
+    '''
+
+    def __init__(self, method, planes):
+        self.method = method
+        self.planes = planes
+
+    @classmethod
+    def build(cls, vol_array, method='max', max_workers=None,
+              slab_bytes=SLAB_BYTES):
+        '''
+        All three projections in one pass over the volume. Slabs along the
+        first axis are reduced concurrently (NumPy releases the GIL), so
+        memory-mapped and chunked volumes are read once and never in full.
+        Args:
+            vol_array(numpy 3D array, numpy.memmap or ChunkedVolume):
+            method(str): 'max', 'mean' or 'min'
+            max_workers(int): number of threads (default: one per CPU)
+            slab_bytes(int): size of the slabs reduced by each thread
+        Returns:
+            VolumeProjections
+        '''
+        if method not in PROJECTIONS:
+            raise ValueError(f"unknown projection {method!r}, expected one of {PROJECTIONS}")
+
+        size_x, size_y, size_z = vol_array.shape
+        accumulator = np.float64 if method == 'mean' else vol_array.dtype
+        along_y = np.empty((size_x, size_z), dtype=accumulator)
+        along_z = np.empty((size_x, size_y), dtype=accumulator)
+        along_x = None
+
+        step = _slab_planes(vol_array, slab_bytes)
+        with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+            futures = {executor.submit(_reduce_slab, vol_array, start, start + step,
+                                       method): start
+                       for start in range(0, size_x, step)}
+            for future in as_completed(futures):
+                start = futures[future]
+                slab_x, slab_y, slab_z = future.result()
+                along_y[start:start+step] = slab_y
+                along_z[start:start+step] = slab_z
+
+                # the x projection combines all slabs
+                if along_x is None:
+                    along_x = slab_x.astype(accumulator)
+                elif method == 'max':
+                    np.maximum(along_x, slab_x, out=along_x)
+                elif method == 'min':
+                    np.minimum(along_x, slab_x, out=along_x)
+                else:
+                    along_x += slab_x
+
+        planes = {'x': along_x, 'y': along_y, 'z': along_z}
+        if method == 'mean':
+            planes = {axis: (plane / length).astype(np.float32)
+                      for (axis, plane), length
+                      in zip(planes.items(), (size_x, size_y, size_z))}
+
+        return cls(method, planes)
+
+    @property
+    def nbytes(self):
+        return sum(plane.nbytes for plane in self.planes.values())
+
+    def __getitem__(self, axis):
+        return self.planes[axis]
@@ -0,0 +1,167 @@
+import struct
+import zlib
+import numpy as np
+from PIL import Image
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# compressed data is written out in IDAT chunks of about this size
+IDAT_CHUNK_BYTES = 1 << 20
+
+# rows per band when streaming an in-memory image
+IMAGE_BAND_ROWS = 256
+
+
+class PNGStreamWriter:
+    '''
+    Writes an RGB PNG row band by row band, so that only the current band
+    and the compressor state are held in memory, however large the image
+    Args:
+        outfile(str or file object): path, or binary file opened for writing
+        width(int):
+        height(int):
+        compress_level(int): zlib level, 0 to 9
+    '''
+
+    def __init__(self, outfile, width, height, compress_level=6):
+        if hasattr(outfile, 'write'):
+            self._file, self._owned = outfile, False
+        else:
+            self._file, self._owned = open(outfile, 'wb'), True
+
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self._compressor = zlib.compressobj(compress_level)
+        self._pending = []
+        self._pending_bytes = 0
+
+        self._file.write(PNG_SIGNATURE)
+        # 8 bits per channel, color type 2 (RGB), no interlacing
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self._file.write(struct.pack('>I', len(data)))
+        self._file.write(kind)
+        self._file.write(data)
+        self._file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
+
+    def _compressed(self, data):
+        if data:
+            self._pending.append(data)
+            self._pending_bytes += len(data)
+        if self._pending_bytes >= IDAT_CHUNK_BYTES:
+            self._flush_idat()
+
+    def _flush_idat(self):
+        if self._pending:
+            self._chunk(b'IDAT', b''.join(self._pending))
+            self._pending = []
+            self._pending_bytes = 0
+
+    def write_rows(self, rows):
+        '''
+        Args:
+            rows((n, width, 3) uint8 numpy array): the next n rows
+        '''
+        rows = np.asarray(rows, dtype=np.uint8)
+        if rows.shape[1:] != (self.width, 3):
+            raise ValueError(f"Expected rows of shape (n, {self.width}, 3), "
+                             f"got {rows.shape}")
+        if self.rows_written + len(rows) > self.height:
+            raise ValueError("More rows than the image height")
+
+        # 'Sub' filter: each byte minus the same channel of the pixel to its
+        # left, which compresses the flat areas of a montage well
+        flat = rows.reshape(len(rows), -1)
+        filtered = np.empty((len(rows), 1 + flat.shape[1]), dtype=np.uint8)
+        filtered[:, 0] = 1
+        filtered[:, 1:4] = flat[:, :3]
+        np.subtract(flat[:, 3:], flat[:, :-3], out=filtered[:, 4:])
+
+        self._compressed(self._compressor.compress(filtered.tobytes()))
+        self.rows_written += len(rows)
+
+    def close(self):
+        '''
+        Finish the PNG; all rows must have been written
+        '''
+        if self.rows_written != self.height:
+            raise ValueError(f"Wrote {self.rows_written} of {self.height} rows")
+        self._compressed(self._compressor.flush())
+        self._flush_idat()
+        self._chunk(b'IEND', b'')
+        if self._owned:
+            self._file.close()
+
+    def abort(self):
+        if self._owned:
+            self._file.close()
+
+
+class ImagePanel:
+    '''
+    An in-memory image (e.g. a Kaleido export) as a panel for write_stacked
+    Args:
+        image(PIL.Image or file object/bytes readable by PIL):
+    '''
+
+    def __init__(self, image):
+        if not isinstance(image, Image.Image):
+            image = Image.open(image)
+        self.image = image.convert('RGB')
+        self.width, self.height = self.image.size
+
+    @classmethod
+    def side_by_side(cls, images, background=(0, 0, 0)):
+        '''
+        One panel with the images next to each other, top-aligned
+        '''
+        images = [image if isinstance(image, Image.Image) else Image.open(image)
+                  for image in images]
+        row = Image.new('RGB', (sum(image.width for image in images),
+                                max(image.height for image in images)), background)
+        left = 0
+        for image in images:
+            row.paste(image, (left, 0))
+            left += image.width
+        return cls(row)
+
+    def bands(self):
+        pixels = np.asarray(self.image)
+        for top in range(0, self.height, IMAGE_BAND_ROWS):
+            yield pixels[top:top + IMAGE_BAND_ROWS]
+
+
+def write_stacked(outfile, panels, background=(0, 0, 0), progress=None):
+    '''
+    Write panels on top of each other into one PNG, streaming each panel's
+    bands straight to the file. A panel is any object with width, height
+    and a bands() generator of (rows, width, 3) uint8 arrays, such as
+    ImagePanel or montage.SliceMontage.
+    Args:
+        outfile(str or file object):
+        panels(list):
+        background(tuple): RGB color right of panels narrower than the widest
+        progress(callable): called as progress(panels_done, panel_count)
+    '''
+    width = max(panel.width for panel in panels)
+    height = sum(panel.height for panel in panels)
+
+    writer = PNGStreamWriter(outfile, width, height)
+    try:
+        for done, panel in enumerate(panels, start=1):
+            for band in panel.bands():
+                if band.shape[1] < width:
+                    padded = np.empty((len(band), width, 3), dtype=np.uint8)
+                    padded[:] = background
+                    padded[:, :band.shape[1]] = band
+                    band = padded
+                writer.write_rows(band)
+            if progress:
+                progress(done, len(panels))
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
@@ -1,12 +1,25 @@
 import math
 import io
+import os
+import glob
+import json
+import time
+import traceback
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import matplotlib
+# images are only saved, never shown; Agg also works in worker processes
+# and on machines without a display
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import plotly.graph_objects as go
 from PIL import Image
 import numpy as np
 
 import miscellaneous_functions as misc
+import colormaps
+import streaming_export
 
 
 ## TODO:
@@ -15,9 +28,12 @@ import miscellaneous_functions as misc
 # - 3D min/max should be percentage 
 
 
-def get_data_array(input_dir):
-    
-    return misc.stack_to_array(input_dir)
+def get_data_array(input_path):
+    '''
+    Args:
+        input_path(str): directory of tif files, or .npy file
+    '''
+    return misc.load_volume(input_path, mmap_mode='r')
 
 
 def render_slices(subvol, direction, cmap_choice="jet", imgs_in_row=6, 
@@ -46,14 +62,18 @@ def render_slices(subvol, direction, cmap_choice="jet", imgs_in_row=6,
         for i, ax in enumerate(row):
             if j*imgs_in_row+i < img_count:
                 if direction == 'x':
-                    ax.imshow(subvol[j*imgs_in_row+i, :, :],cmap=cmap_choice)
-                    ax.set_title(f'x-slice {j*imgs_in_row+i}')
+                    plane = subvol[j*imgs_in_row+i, :, :]
                 elif direction == 'y':
-                    ax.imshow(subvol[:,j*imgs_in_row+i, :],cmap=cmap_choice)
-                    ax.set_title(f'y-slice {j*imgs_in_row+i}')
+                    plane = subvol[:,j*imgs_in_row+i, :]
                 else:  # z
-                    ax.imshow(subvol[:,:, j*imgs_in_row+i], cmap=cmap_choice)
-                    ax.set_title(f'z-slice {j*imgs_in_row+i}')
+                    plane = subvol[:,:, j*imgs_in_row+i]
+                # each slice is scaled to its own min/max, like plt.imshow,
+                # with matplotlib's definition of the colormap
+                ax.imshow(colormaps.apply_colormap(plane, plane.min(),
+                                                   plane.max(), cmap_choice,
+                                                   prefer='matplotlib',
+                                                   reuse_window=False))
+                ax.set_title(f'{direction}-slice {j*imgs_in_row+i}')
 
     title = f'{direction}-slices'
     f.suptitle(title, fontsize=12)
@@ -76,13 +96,13 @@ def render_3d_volume_plotly(subvol, direction='z', color_choice="jet",
 
     size_x, size_y, size_z = np.shape(subvol)
 
-    X, Y, Z = np.mgrid[0:size_x, 0:size_y, 0:size_z]
+    X, Y, Z = misc.volume_coordinates((size_x, size_y, size_z))
     
     vol = go.Volume(
-          x = X.flatten(),
-          y = Y.flatten(),
-          z = Z.flatten(),
-          value = subvol.flatten(),
+          x = X,
+          y = Y,
+          z = Z,
+          value = np.asarray(subvol).ravel(),
           opacity = 0.3,
           opacityscale = 0.3,
           surface_count = 10,
@@ -158,60 +178,196 @@ def create_summary(subvol, outfile):
         images.append(plotly_img)
     
     
-    # Convert the byte arrays to viewable images and concatenate
+    # Convert the byte arrays to viewable images and stream them to outfile
     graphs = [Image.open(img) for img in images]
     print("image Files length: ", len(graphs))
     
     # At this point, there should be 6 images 
     
-    img_size = [0,0] # (width, height)
-    
-    # Only up to the first plotly image for calculating 
-    # as the other plotly images will be added to the side.
-    # (3 plotly images side by side should be less than matplotlib 
-    # image width)
-    for graph in graphs[0:4]: 
-        if graph.width > img_size[0]:
-            img_size[0] = graph.width
-        img_size[1] = img_size[1] + graph.height
-        
-    #print("width: ", img_width)
-    #print("height: ", img_height)
-    
-    summary_img = Image.new('RGB', (img_size[0], img_size[1]))
-    current_pos = [0,0]
-    
-    ##  Stitch all graphs together
-    # Matplotlib images
-    for graph in graphs[0:3]:
-        summary_img.paste(graph,  current_pos)
-        # bring the current position down by the pasted image's height
-        current_pos = (0, current_pos[1] + graph.height)
-    
-    # Plotly images
-    for graph in graphs[3:6]:
-        summary_img.paste(graph, current_pos)
-        # shift it to the side
-        current_pos = (current_pos[0] + graph.width, current_pos[1])
-    
-    summary_img.save(outfile)
+    # Matplotlib images on top of each other, then the 3 plotly images
+    # side by side in one row
+    panels = [streaming_export.ImagePanel(graph) for graph in graphs[0:3]]
+    panels.append(streaming_export.ImagePanel.side_by_side(graphs[3:6]))
+
+    streaming_export.write_stacked(outfile, panels)
     
     for img in images:
         img.close()
     
         
 
+def find_inputs(manifest=None, patterns=()):
+    '''
+    Input directories/.npy files listed in a manifest (one path per line,
+    # for comments) and matched by glob patterns, without duplicates
+    Returns:
+        list of paths, in manifest then pattern order
+    '''
+    inputs = []
+    if manifest:
+        with open(manifest) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    inputs.append(line)
+
+    for pattern in patterns:
+        inputs.extend(sorted(glob.glob(pattern, recursive=True)))
+
+    return list(dict.fromkeys(os.path.normpath(path) for path in inputs))
+
+
+def summary_path(input_path, output_dir):
+    '''
+    Output file for an input: <output_dir>/<input name>_summary.png
+    '''
+    return os.path.join(output_dir, Path(input_path).stem + "_summary.png")
+
+
+def input_mtime(input_path):
+    '''
+    Latest modification time of an .npy file, or of a directory of tifs
+    and the files in it
+    '''
+    path = Path(input_path)
+    if path.is_dir():
+        return max([path.stat().st_mtime] + [f.stat().st_mtime for f in path.iterdir()])
+    return path.stat().st_mtime
+
+
+def is_up_to_date(input_path, outfile):
+    return os.path.exists(outfile) and \
+        os.path.getmtime(outfile) >= input_mtime(input_path)
+
+
+def summarize(input_path, outfile):
+    '''
+    Create one summary; runs in a worker process of run_batch
+    Returns:
+        result record (dict) for the results log
+    '''
+    result = {"input": input_path, "output": outfile, "status": "done",
+              "error": None}
+    start = time.perf_counter()
+    try:
+        if not os.path.exists(input_path):
+            raise FileNotFoundError(input_path)
+        subvol = get_data_array(input_path)
+        result["shape"] = list(subvol.shape)
+        result["load_seconds"] = round(time.perf_counter() - start, 3)
+
+        # write next to the output and rename, so that an interrupted run
+        # never leaves a partial file that looks up to date
+        partial = outfile + ".partial"
+        create_summary(subvol, partial)
+        os.replace(partial, outfile)
+    except Exception:
+        result["status"] = "failed"
+        result["error"] = traceback.format_exc()
+
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def run_batch(inputs, output_dir, workers=None, log_path=None, force=False):
+    '''
+    Create the summaries of many inputs on a pool of worker processes.
+    Inputs whose summary is newer than the input are skipped unless force;
+    a failed input is recorded and the others carry on.
+    Args:
+        inputs(list): directories of tif files and/or .npy files
+        output_dir(str): summaries are written as <input name>_summary.png
+        workers(int): number of processes; default is the number of CPUs
+        log_path(str): results log, one JSON record per line (appended)
+        force(boolean): recreate summaries that are up to date
+    Returns:
+        list of result records
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+
+    # inputs resolved without rendering: skipped or failed up front
+    resolved = []
+    todo = {}  # input path -> output file
+    for input_path in inputs:
+        outfile = summary_path(input_path, output_dir)
+        if outfile in todo.values():
+            resolved.append({"input": input_path, "output": outfile,
+                             "status": "failed", "seconds": 0,
+                             "error": "another input has the same output file"})
+        elif not force and os.path.exists(input_path) \
+                and is_up_to_date(input_path, outfile):
+            resolved.append({"input": input_path, "output": outfile,
+                             "status": "skipped", "seconds": 0, "error": None})
+        else:
+            todo[input_path] = outfile
+
+    results = []
+    log = open(log_path, 'a') if log_path else None
+
+    def record(result):
+        results.append(result)
+        if log:
+            log.write(json.dumps(result) + "\n")
+            log.flush()
+        print(f"[{len(results)}/{len(inputs)}] {result['status']}: "
+              f"{result['input']} ({result['seconds']}s)")
+
+    try:
+        for result in resolved:
+            record(result)
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(summarize, input_path, outfile): input_path
+                       for input_path, outfile in todo.items()}
+            for future in as_completed(futures):
+                try:
+                    record(future.result())
+                except Exception:
+                    # the worker process itself died (e.g. out of memory)
+                    input_path = futures[future]
+                    record({"input": input_path, "output": todo[input_path],
+                            "status": "failed", "seconds": None,
+                            "error": traceback.format_exc()})
+    finally:
+        if log:
+            log.close()
+
+    return results
+
+
 if __name__ == "__main__":
     
     parser = argparse.ArgumentParser()
 
     parser.add_argument("--input_dir", help="path to input data directory")
     parser.add_argument("--outfile", help="output file path")
+
+    # batch mode
+    parser.add_argument("--manifest",
+                        help="file listing input directories/.npy files, one per line")
+    parser.add_argument("--glob", action="append", default=[],
+                        help="glob pattern of input directories/.npy files "
+                             "(can be repeated)")
+    parser.add_argument("--output_dir", help="output directory for batch mode")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: CPU count)")
+    parser.add_argument("--log", help="results log (JSON lines) for batch mode")
+    parser.add_argument("--force", action="store_true",
+                        help="recreate summaries that are up to date")
     args = parser.parse_args()
 
+    if args.manifest or args.glob:
+        if not args.output_dir:
+            parser.error("--output_dir is required with --manifest/--glob")
+        inputs = find_inputs(args.manifest, args.glob)
+        results = run_batch(inputs, args.output_dir, workers=args.workers,
+                            log_path=args.log, force=args.force)
+        failed = [result for result in results if result["status"] == "failed"]
+        print(f"{len(results) - len(failed)} of {len(results)} done or up to date")
+        raise SystemExit(1 if failed else 0)
+
     input_data_dir = args.input_dir
     outfile = args.outfile
 
     subvol = get_data_array(input_data_dir)
     create_summary(subvol, outfile)
-    
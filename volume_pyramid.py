@@ -0,0 +1,99 @@
+import numpy as np
+
+
+# Levels are added until the coarsest has at most this many voxels, so that
+# any voxel budget from this size up is met by some level
+MIN_LEVEL_VOXELS = 1000
+
+
+def downsample(vol_array, factor=2, method='mean'):
+    '''
+    Reduce each factor x factor x factor block of a volume to one voxel.
+    Edge blocks that are not full are padded with their edge values.
+    The volume is processed in slabs, so memory-mapped input is fine.
+    Args:
+        vol_array(numpy 3D array or numpy.memmap):
+        factor(int): block size along every axis
+        method(str): 'mean' or 'max'
+    Returns:
+        numpy 3D array with the dtype of vol_array
+    '''
+    out_shape = tuple(-(-n // factor) for n in vol_array.shape)
+    out = np.empty(out_shape, dtype=vol_array.dtype)
+
+    # slabs must hold a whole number of blocks along the first axis
+    slab_bytes = 64 * 1024**2
+    plane_bytes = max(1, vol_array[0:1].nbytes)
+    slab_planes = max(1, slab_bytes // (plane_bytes * factor)) * factor
+
+    for start in range(0, vol_array.shape[0], slab_planes):
+        block = np.asarray(vol_array[start:start+slab_planes])
+
+        pad = [(0, (-n) % factor) for n in block.shape]
+        if any(after for _, after in pad):
+            block = np.pad(block, pad, mode='edge')
+
+        sx, sy, sz = block.shape
+        blocks = block.reshape(sx//factor, factor, sy//factor, factor,
+                               sz//factor, factor)
+        if method == 'max':
+            reduced = blocks.max(axis=(1, 3, 5))
+        else:
+            reduced = blocks.mean(axis=(1, 3, 5), dtype=np.float64)
+            if np.issubdtype(out.dtype, np.integer):
+                reduced = np.rint(reduced)
+
+        out[start//factor:start//factor + reduced.shape[0]] = reduced
+
+    return out
+
+
+class VolumePyramid:
+    '''
+    Downsampled copies of a volume (1x, 2x, 4x, ...), used to keep the 3D
+    rendering within a voxel budget
+    Attributes:
+        levels(list): (factor, numpy 3D array) from finest to coarsest;
+                      level 0 is the original volume
+    '''
+
+    def __init__(self, levels):
+        self.levels = levels
+
+    @classmethod
+    def build(cls, vol_array, min_voxels=MIN_LEVEL_VOXELS, method='mean'):
+        '''
+        Args:
+            vol_array(numpy 3D array or numpy.memmap):
+            min_voxels(int): levels are halved until the coarsest has at
+                             most this many voxels (or is a single voxel)
+            method(str): 'mean' or 'max' (see downsample)
+        Returns:
+            VolumePyramid
+        '''
+        levels = [(1, vol_array)]
+        factor = 2
+        while levels[-1][1].size > min_voxels and max(levels[-1][1].shape) > 1:
+            # each level is built from the previous one
+            levels.append((factor, downsample(levels[-1][1], 2, method)))
+            factor *= 2
+
+        return cls(levels)
+
+    @property
+    def nbytes(self):
+        # the original volume is accounted for separately
+        return sum(level.nbytes for _, level in self.levels[1:])
+
+    def level_for_budget(self, voxel_budget):
+        '''
+        Args:
+            voxel_budget(int): maximum number of voxels to render
+        Returns:
+            index of the finest level within the budget (the coarsest
+            level if the budget is below the min_voxels of build)
+        '''
+        for index, (_, level) in enumerate(self.levels):
+            if level.size <= voxel_budget:
+                return index
+        return len(self.levels) - 1
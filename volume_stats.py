@@ -0,0 +1,155 @@
+import numpy as np
+
+
+# Integer volumes whose value range is wider than this fall back to sampling
+MAX_HISTOGRAM_BINS = 1 << 24
+
+# Number of values kept (sorted) for percentile queries on float volumes
+MAX_FLOAT_SAMPLES = 1 << 22
+
+
+def iter_slabs(vol_array, slab_bytes=64 * 1024**2):
+    '''
+    Yield consecutive slabs along the first axis, each about slab_bytes in
+    size, so that full-volume passes over memory-mapped data stay bounded
+    Args:
+        vol_array(numpy 3D array or numpy.memmap):
+        slab_bytes(int): target size of each slab
+    Yields:
+        numpy 3D array (views of vol_array)
+    '''
+    plane_bytes = max(1, vol_array[0:1].nbytes)
+    step = max(1, slab_bytes // plane_bytes)
+
+    for start in range(0, vol_array.shape[0], step):
+        yield vol_array[start:start+step]
+
+
+class VolumeStats:
+    '''
+    Intensity statistics of a volume, computed once and reused for every
+    percentile lookup. Integer volumes keep an exact cumulative histogram;
+    float volumes keep a sorted sample (exact up to MAX_FLOAT_SAMPLES values).
+
+    Attributes:
+        dtype(numpy.dtype): dtype of the source volume
+        dtype_range(tuple): (min, max) representable by the dtype
+        size(int): number of voxels
+        min(float):
+        max(float):
+        mean(float):
+        exact(bool): whether percentiles match np.percentile exactly
+    '''
+
+    def __init__(self, values, cumulative_counts, dtype, size, minval, maxval,
+                 mean, exact):
+        self._values = values
+        # None for a sorted sample, where the rank of a value is its index
+        self._cdf = cumulative_counts
+        self.dtype = np.dtype(dtype)
+        self.size = int(size)
+        self.min = float(minval)
+        self.max = float(maxval)
+        self.mean = float(mean)
+        self.exact = exact
+
+        if self.dtype == np.bool_:
+            self.dtype_range = (0, 1)
+        elif np.issubdtype(self.dtype, np.integer):
+            info = np.iinfo(self.dtype)
+            self.dtype_range = (int(info.min), int(info.max))
+        else:
+            info = np.finfo(self.dtype)
+            self.dtype_range = (float(info.min), float(info.max))
+
+    @classmethod
+    def from_array(cls, vol_array):
+        '''
+        Args:
+            vol_array(numpy 3D array or numpy.memmap):
+        Returns:
+            VolumeStats
+        '''
+        minval, maxval, total = None, None, 0.0
+        for slab in iter_slabs(vol_array):
+            slab_min, slab_max = slab.min(), slab.max()
+            minval = slab_min if minval is None else min(minval, slab_min)
+            maxval = slab_max if maxval is None else max(maxval, slab_max)
+            total += slab.sum(dtype=np.float64)
+        mean = total / vol_array.size
+
+        # masks and segmentations take the exact histogram path too
+        is_integer = np.issubdtype(vol_array.dtype, np.integer) or \
+            vol_array.dtype == np.bool_
+        value_range = int(maxval) - int(minval) + 1 if is_integer else None
+
+        if is_integer and value_range <= MAX_HISTOGRAM_BINS:
+            counts = np.zeros(value_range, dtype=np.int64)
+            for slab in iter_slabs(vol_array):
+                offsets = slab.ravel().astype(np.int64) - int(minval)
+                counts += np.bincount(offsets, minlength=value_range)
+
+            present = np.flatnonzero(counts)
+            values = present + int(minval)
+            cumulative_counts = np.cumsum(counts[present])
+            exact = True
+
+        else:
+            step = max(1, -(-vol_array.size // MAX_FLOAT_SAMPLES))
+            # every step-th value in C order, taken slab by slab
+            samples, position = [], 0
+            for slab in iter_slabs(vol_array):
+                flat = slab.reshape(-1)
+                samples.append(flat[-position % step::step])
+                position += flat.size
+            values = np.sort(np.concatenate(samples).astype(np.float64))
+            cumulative_counts = None
+            exact = step == 1
+
+        return cls(values, cumulative_counts, vol_array.dtype, vol_array.size,
+                   minval, maxval, mean, exact)
+
+    @property
+    def nbytes(self):
+        cdf_bytes = 0 if self._cdf is None else self._cdf.nbytes
+        return self._values.nbytes + cdf_bytes
+
+    @property
+    def _count(self):
+        # number of values the ranks refer to
+        return len(self._values) if self._cdf is None else int(self._cdf[-1])
+
+    def _value_at_rank(self, rank):
+        # value of the rank-th smallest voxel (0-based)
+        if self._cdf is None:
+            index = rank
+        else:
+            index = np.searchsorted(self._cdf, rank, side='right')
+        return self._values[min(index, len(self._values) - 1)]
+
+    def percentile(self, q):
+        '''
+        Same interpolation as np.percentile (method='linear')
+        Args:
+            q(float): percentile in [0, 100]
+        Returns:
+            float
+        '''
+        q = min(max(float(q), 0.0), 100.0)
+        rank = q / 100.0 * (self._count - 1)
+        lower = int(np.floor(rank))
+        fraction = rank - lower
+
+        lower_value = float(self._value_at_rank(lower))
+        if fraction == 0:
+            return lower_value
+
+        upper_value = float(self._value_at_rank(lower + 1))
+        return lower_value + fraction * (upper_value - lower_value)
+
+    def window(self, min_pct, max_pct):
+        '''
+        Returns:
+            (zmin, zmax) intensity values at the given percentiles
+        '''
+        return self.percentile(min_pct), self.percentile(max_pct)